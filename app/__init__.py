@@ -1,6 +1,9 @@
 from flask import Flask
+import atexit
 import os
-from app.api import controllers
+import signal
+import sys
+import threading
 from .database import db
 from flask_migrate import Migrate
 
@@ -12,9 +15,66 @@ def create_app():
     db.init_app(app)
     migrate = Migrate(app, db)
     with app.test_request_context():
+        # Models are imported before create_all, so their tables are known.
+        from app.api.models import DailyStatistic, HourlyStatistic, \
+            OfferChange, ProductTree, TreeVersion
         db.create_all()
+        TreeVersion.ensure()
+
+        if ProductTree.strategy() == ProductTree.CLOSURE:
+            ProductTree.check_closure()
+
+        OfferChange.backfill()
+        HourlyStatistic.backfill()
+        DailyStatistic.backfill()
+        if app.config.get('SALES_BUFFER', False):
+            from app.api.recent import recent_changes
+            recent_changes.enabled = True
+            OfferChange.load_recent()
+
+        if app.config.get('TREE_INDEX', False):
+            snapshot = app.config.get('TREE_SNAPSHOT')
+            if snapshot is None:
+                ProductTree.load_index()
+            else:
+                ProductTree.warm_start_index(
+                    snapshot, app.config.get('TREE_SNAPSHOT_CHECK', True))
+                atexit.register(ProductTree.save_index_snapshot, snapshot)
+                # docker stop sends SIGTERM, which skips atexit handlers
+                # unless the interpreter exits normally.
+                if threading.current_thread() is threading.main_thread():
+                    signal.signal(signal.SIGTERM,
+                                  lambda signum, frame: sys.exit(0))
+
+    from app.api.encoder import json_encoder, response_encoder
+    json_encoder.configure(app.config.get('JSON_ENCODER', 'json'),
+                           app.config.get('JSON_AS_ASCII', True))
+    response_encoder.compression = app.config.get('RESPONSE_COMPRESSION', True)
+
+    from app.api.cache import response_cache
+    response_cache.max_bytes = app.config.get('NODES_CACHE_BYTES', 0)
+
+    sync = app.config.get('TREE_SYNC', 'poll')
+    has_replicas = app.config.get('TREE_INDEX', False) or \
+        response_cache.enabled or app.config.get('SALES_BUFFER', False)
+    # Polling only applies changes of other processes, so it is not
+    # needed without replicas; with 'notify' this process also publishes.
+    if sync == 'notify' or sync == 'poll' and has_replicas:
+        from app.api.models import ProductTree
+        ProductTree.start_listener(
+            app, sync, app.config.get('TREE_SYNC_INTERVAL', 1))
 
     import app.api.controllers as shop_api
     app.register_blueprint(shop_api.api_module)
 
+    if app.config.get('IMPORTS_PROCESSES', 0) > 0:
+        from app.api.jobs import validation_pool
+        validation_pool.start(
+            app.config['IMPORTS_PROCESSES'],
+            app.config.get('IMPORTS_PARALLEL_THRESHOLD', 0))
+
+    if app.config.get('IMPORTS_ASYNC', False):
+        from app.api.jobs import import_queue
+        import_queue.start(app, shop_api.apply_import_job)
+
     return app
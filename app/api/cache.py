@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized responses of node subtrees limited by size in
+    bytes. Entries are keyed by node id and variant (format of the
+    response). Every invalidate increases clock and records it as version
+    of the invalidated nodes; a response is cached only if computation
+    started (see version) not before the last invalidation of its node,
+    so a response computed before the change is never returned after it.
+    Versions of at most MAX_VERSIONS nodes are kept, older ones are
+    replaced by floor: the version of nodes without their own one.
+
+    Attributes:
+    -----------
+    max_bytes: int
+        limit of size of all cached responses, 0 disables cache
+    hits, misses, evictions, invalidations: int
+        counters of cache usage
+    size: int
+        size of all cached responses in bytes
+    """
+    MAX_VERSIONS = 10_000
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.versions = OrderedDict()
+        self.clock = 0
+        self.floor = 0
+        self.variants = {''}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def version(self, node_id: str) -> int:
+        """ Returns version for put of node_id, take it before computing. """
+        with self.lock:
+            return self.clock
+
+    def get(self, node_id: str, variant: str = '') -> Optional[bytes]:
+        """ Returns cached response of node_id or None. """
+        with self.lock:
+            key = (node_id, variant)
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, node_id: str, version: int, body: bytes,
+            variant: str = '') -> None:
+        """
+        Caches response body of node_id computed for version. Response
+        of an outdated version or larger than max_bytes is not cached.
+        """
+        with self.lock:
+            if version < self.versions.get(node_id, self.floor) or \
+                    len(body) > self.max_bytes:
+                return
+            key = (node_id, variant)
+            self.variants.add(variant)
+            if key in self.entries:
+                self.size -= len(self.entries[key])
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, old_body = self.entries.popitem(last=False)
+                self.size -= len(old_body)
+                self.evictions += 1
+
+    def invalidate(self, node_ids: Iterable[str]) -> None:
+        """ Increases versions of node_ids and drops their responses. """
+        with self.lock:
+            self.clock += 1
+            for node_id in node_ids:
+                for variant in self.variants:
+                    body = self.entries.pop((node_id, variant), None)
+                    if body is not None:
+                        self.size -= len(body)
+                        self.invalidations += 1
+                self.versions[node_id] = self.clock
+                self.versions.move_to_end(node_id)
+                # Trimmed at once, so a large import does not keep
+                # versions of all its nodes.
+                if len(self.versions) > ResponseCache.MAX_VERSIONS:
+                    _, version = self.versions.popitem(last=False)
+                    self.floor = max(self.floor, version)
+
+    def clear(self) -> None:
+        """ Drops all responses, responses computed before are not cached. """
+        with self.lock:
+            self.entries.clear()
+            self.clock += 1
+            self.versions.clear()
+            self.floor = self.clock
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return dict(
+                entries=len(self.entries), bytes=self.size,
+                maxBytes=self.max_bytes, hits=self.hits, misses=self.misses,
+                hitRate=self.hits / requests if requests != 0 else None,
+                evictions=self.evictions, invalidations=self.invalidations)
+
+
+response_cache = ResponseCache()
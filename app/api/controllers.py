@@ -1,8 +1,12 @@
 import datetime
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, current_app, stream_with_context
 
-from .models import ProductTree, ShopUnitImportRequest, Product, Statistic
+from .cache import response_cache
+from .encoder import json_encoder, response_encoder
+from .index import product_index
+from .jobs import import_queue, validation_pool
+from .models import ProductTree, ShopUnitImportStream, Product, Statistic
 from .utils import ValidationException, ItemNotFoundException, parse_iso, \
     is_cor_uuid
 
@@ -11,48 +15,186 @@ api_module = Blueprint('api', __name__, url_prefix='')
 
 def json_message(code, message):
     """ Convert dict(code=code, message=message) to json. """
-    return jsonify({'code': code, 'message': message})
+    return json_encoder.response({'code': code, 'message': message})
 
 
-@api_module.post('/imports')
-def imports():
-    try:
-        import_data = ShopUnitImportRequest(**request.json)
-        ProductTree.add_or_update_all(import_data.get_products_list())
+def apply_import(import_data: ShopUnitImportStream) -> None:
+    """ Applies import and writes statistics. """
+    # Тело запроса читается и применяется по частям в одной транзакции,
+    # статистика изменённых товаров/категорий пишется в ней же.
+    ProductTree.add_or_update_stream(import_data)
+
+
+def read_import(stream) -> ShopUnitImportStream:
+    """ Returns reader of import from stream using validation_pool if any. """
+    return ShopUnitImportStream(
+        stream, pool=validation_pool if validation_pool.enabled else None)
+
+
+def validate_import(stream):
+    """ Validates import without applying, returns (update_date, items). """
+    import_data = read_import(stream)
+    for _ in import_data.chunks():
+        pass
+    return import_data.update_date, import_data.count
+
 
-        # Обновляем статистику после изменений товаров/категорий,
-        # т.к. гарантируется, что updateDate возрастает с каждым запросом.
+def apply_import_job(job) -> None:
+    """ Applies import of queued job (see jobs.ImportQueue). """
+    job.stream = read_import(job.file)
+    apply_import(job.stream)
 
-        Product.write_statistics(import_data.update_date)
 
+def in_turn_with_imports(func):
+    """
+    Calls func() changing products after imports accepted before it, if
+    imports are applied asynchronously (see jobs.ImportQueue.call).
+    """
+    if import_queue.enabled:
+        return import_queue.call(func)
+    return func()
+
+
+@api_module.post('/imports')
+def imports():
+    if import_queue.enabled:
+        try:
+            job = import_queue.submit(request.stream, validate_import)
+        except Exception:
+            raise ValidationException
+        return json_encoder.response(
+            {'code': 202, 'message': 'Accepted', 'jobId': job.id}), 202
+
+    try:
+        apply_import(read_import(request.stream))
     except Exception as e:
         raise ValidationException
 
     return json_message(200, 'Accepted')
 
 
+@api_module.get('/imports/<job_id>')
+def import_status(job_id):
+    job = import_queue.get(job_id)
+    if job is None:
+        raise ItemNotFoundException
+
+    return response_encoder.response(job.to_dict())
+
+
 @api_module.delete('/delete/<id>')
 def delete(id):
     if not is_cor_uuid(id):
         raise ValidationException
 
     try:
-        ProductTree.remove_node(id)
+        in_turn_with_imports(lambda: ProductTree.remove_node(id))
     except Exception:
         raise ItemNotFoundException
 
     return json_message(200, 'Accepted')
 
 
+@api_module.post('/delete')
+def delete_many():
+    """
+    Deletes all ids of body {"ids": [...]} in one transaction. Returns
+    code and message for every id like /delete/<id>.
+    """
+    try:
+        ids = request.json['ids']
+        if not isinstance(ids, list):
+            raise ValidationException
+    except Exception:
+        raise ValidationException
+
+    valid_ids = [x for x in ids if isinstance(x, str) and is_cor_uuid(x)]
+    deleted = in_turn_with_imports(lambda: ProductTree.remove_nodes(valid_ids))
+
+    items = []
+    for x in ids:
+        if not isinstance(x, str) or x not in deleted:
+            items.append(dict(id=x, code=400, message='Validation Failed'))
+        elif deleted[x]:
+            items.append(dict(id=x, code=200, message='Accepted'))
+        else:
+            items.append(dict(id=x, code=404, message='Item not found'))
+
+    return json_encoder.response({'items': items})
+
+
+@api_module.get('/nodes')
+def nodes_many():
+    """
+    Returns {id: subtree} for ids of query (/nodes?ids=a&ids=b or
+    /nodes?ids=a,b); subtree is null if node is not found.
+    """
+    ids = [x for value in request.args.getlist('ids')
+           for x in value.split(',') if x != '']
+    if len(ids) == 0 or not all(is_cor_uuid(x) for x in ids):
+        raise ValidationException
+
+    return response_encoder.response(ProductTree.get_subtrees(ids))
+
+
+def int_arg(name, min_value):
+    """ Returns int query argument name or None, it must be >= min_value. """
+    value = request.args.get(name, None)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationException
+    if value < min_value:
+        raise ValidationException
+    return value
+
+
 @api_module.get('/nodes/<id>')
 def nodes(id):
     if not is_cor_uuid(id):
         raise ValidationException
 
-    try:
-        return jsonify(ProductTree.get_subtree(id))
-    except Exception:
-        raise ItemNotFoundException
+    depth = int_arg('depth', 0)
+    limit = int_arg('limit', 1)
+    cursor = request.args.get('cursor', None)
+    if cursor is not None and not is_cor_uuid(cursor):
+        raise ValidationException
+
+    if depth is not None or limit is not None or cursor is not None:
+        try:
+            return response_encoder.response(ProductTree.get_subtree_page(
+                id, depth=depth, limit=limit, cursor=cursor))
+        except Exception:
+            raise ItemNotFoundException
+
+    media_type, encoding = response_encoder.negotiate()
+    if not response_cache.enabled and media_type == response_encoder.JSON:
+        # Ответ пишется по мере чтения строк из БД.
+        try:
+            parts = ProductTree.iter_subtree_json(
+                id, current_app.config['JSON_AS_ASCII'])
+        except Exception:
+            raise ItemNotFoundException
+        body = response_encoder.compress(
+            (part.encode() for part in parts), encoding)
+        return response_encoder.make_response(
+            stream_with_context(body), media_type, encoding)
+
+    variant = f'{media_type};{encoding}'
+    body = response_cache.get(id, variant) if response_cache.enabled else None
+    if body is None:
+        version = response_cache.version(id)
+        try:
+            body = response_encoder.encode(
+                ProductTree.get_subtree(id), media_type, encoding)
+        except Exception:
+            raise ItemNotFoundException
+        if response_cache.enabled:
+            response_cache.put(id, version, body, variant)
+
+    return response_encoder.make_response(body, media_type, encoding)
 
 
 """ Дополнительные задания. """
@@ -60,18 +202,37 @@ def nodes(id):
 
 @api_module.get('/sales')
 def sales():
+    """
+    Returns offers changed in 24 hours before date. With limit or cursor
+    returns page with nextCursor, with Accept: application/x-ndjson
+    streams items line by line.
+    """
     try:
         now = parse_iso(request.values['date'])
-        day_before = now - datetime.timedelta(days=1)
-        # Данные получаем из таблицы products, т.к.
-        # в запросах все даты возрастают.
-        return jsonify(Product.get_from_period(day_before, now))
-    except Exception as e:
+    except Exception:
         raise ValidationException
+    day_before = now - datetime.timedelta(days=1)
+    limit = int_arg('limit', 1)
+    cursor = request.args.get('cursor', None)
+
+    # Данные получаем из таблицы offer_changes по индексу update_date.
+    media_type, encoding = response_encoder.negotiate(lines=True)
+    if media_type == response_encoder.NDJSON:
+        return response_encoder.lines_response(Product.iter_from_period(
+            day_before, now, limit, cursor), encoding)
+    if limit is not None or cursor is not None:
+        return response_encoder.response(Product.get_from_period_page(
+            day_before, now, limit, cursor))
+    return response_encoder.response(Product.get_from_period(day_before, now))
 
 
 @api_module.get('/node/<id>/statistic')
 def node_statistic(id):
+    """
+    Returns statistics of node for [dateStart, dateEnd). Pages and NDJSON
+    are requested like in /sales. Parameter resolution selects rows:
+    'raw' (default), hourly or daily rollups ('hour', 'day'), or 'auto'.
+    """
     if not is_cor_uuid(id):
         raise ValidationException
 
@@ -85,9 +246,38 @@ def node_statistic(id):
         except Exception:
             raise ValidationException
 
-    res = Statistic.get(id, date_start, date_end)
+    limit = int_arg('limit', 1)
+    cursor = request.args.get('cursor', None)
+    resolution = request.args.get('resolution', Statistic.RAW)
+
+    media_type, encoding = response_encoder.negotiate(lines=True)
+    if media_type == response_encoder.NDJSON:
+        return response_encoder.lines_response(Statistic.iter_items(
+            id, date_start, date_end, limit, cursor, resolution), encoding)
+    if limit is not None or cursor is not None:
+        return response_encoder.response(Statistic.get_page(
+            id, date_start, date_end, limit, cursor, resolution))
+
+    res = Statistic.get(id, date_start, date_end, resolution)
+
+    return response_encoder.response(res)
+
+
+@api_module.get('/nodes-cache/stats')
+def nodes_cache_stats():
+    return response_encoder.response(response_cache.stats())
+
+
+@api_module.post('/nodes-index/check')
+def nodes_index_check():
+    """
+    Compares in-process tree index with table 'products' and reloads
+    nodes which differ. Returns {"ids": [...]} of these nodes.
+    """
+    if not product_index.loaded:
+        raise ItemNotFoundException
 
-    return jsonify(res)
+    return json_encoder.response({'ids': ProductTree.check_index()})
 
 
 @api_module.app_errorhandler(ValidationException)
@@ -0,0 +1,248 @@
+import datetime
+import functools
+import json
+import logging
+import re
+import zlib
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from flask import current_app, request, stream_with_context
+
+from app.api.utils import date_to_iso
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class JsonEncoder:
+    """
+    Encoder of JSON responses of the API.
+
+    Backend 'json' writes the same bytes as jsonify (sorted keys, compact
+    separators), but reuses one encoder. Backend 'orjson' is several
+    times faster; it is used only if package orjson is installed. Both
+    backends write the same bytes: non-ASCII characters are escaped if
+    ensure_ascii (JSON_AS_ASCII of the application) is True, otherwise
+    they are written as UTF-8. Dates are written in application ISO
+    format.
+
+    Attributes:
+    -----------
+    backend: str
+        name of the used backend
+    ensure_ascii: bool
+        True if non-ASCII characters are escaped
+    """
+    JSON = 'json'
+    ORJSON = 'orjson'
+
+    # Characters escaped by json with ensure_ascii and not by orjson.
+    ESCAPED_RE = re.compile('[^\x00-\x7e]')
+
+    def __init__(self):
+        self.backend = JsonEncoder.JSON
+        self.ensure_ascii = True
+        self.__encoder = JsonEncoder.__make_encoder(True)
+
+    def configure(self, backend: str, ensure_ascii: bool = True) -> None:
+        if backend not in (JsonEncoder.JSON, JsonEncoder.ORJSON):
+            raise ValueError(f'Unknown JSON encoder {backend}')
+        if backend == JsonEncoder.ORJSON and orjson is None:
+            logging.getLogger(__name__).warning(
+                'orjson is not installed, JSON encoder "json" is used')
+            backend = JsonEncoder.JSON
+        self.backend = backend
+        self.ensure_ascii = ensure_ascii
+        self.__encoder = JsonEncoder.__make_encoder(ensure_ascii)
+
+    def dumps(self, obj) -> bytes:
+        """ Returns JSON of obj ending with a new line. """
+        if self.backend == JsonEncoder.ORJSON:
+            data = orjson.dumps(
+                obj, default=JsonEncoder.__default,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE |
+                orjson.OPT_PASSTHROUGH_DATETIME)
+            if self.ensure_ascii and \
+                    (not data.isascii() or b'\x7f' in data):
+                # Such characters may be only in strings.
+                data = JsonEncoder.ESCAPED_RE.sub(
+                    lambda match: json.dumps(match.group())[1:-1],
+                    data.decode()).encode()
+            return data
+        return (self.__encoder.encode(obj) + '\n').encode()
+
+    def response(self, obj):
+        """ Returns response with JSON of obj, like jsonify. """
+        return current_app.response_class(
+            self.dumps(obj), mimetype='application/json')
+
+    @staticmethod
+    def __make_encoder(ensure_ascii: bool) -> json.JSONEncoder:
+        return json.JSONEncoder(
+            sort_keys=True, separators=(',', ':'), ensure_ascii=ensure_ascii,
+            default=JsonEncoder.__default)
+
+    @staticmethod
+    def __default(obj):
+        if isinstance(obj, datetime.datetime):
+            return date_to_iso(obj)
+        raise TypeError(f'Object of type {type(obj).__name__} '
+                        f'is not JSON serializable')
+
+
+json_encoder = JsonEncoder()
+
+
+class ResponseEncoder:
+    """
+    Encoder of responses of read endpoints. Format is negotiated by
+    header Accept: JSON, MessagePack or CBOR with the same schema, binary
+    formats are offered only if packages msgpack and cbor2 are installed.
+    Endpoints of lists also offer NDJSON: items streamed line by line.
+    In binary formats dates are timestamps: extension type -1 of
+    MessagePack and tag 1 of CBOR. Body is compressed by zstd (package
+    zstandard) or gzip if it is allowed by header Accept-Encoding.
+
+    Attributes:
+    -----------
+    compression: bool
+        False if responses are never compressed
+    """
+    JSON = 'application/json'
+    MSGPACK = 'application/msgpack'
+    CBOR = 'application/cbor'
+    NDJSON = 'application/x-ndjson'
+
+    # Media types used by older clients of MessagePack.
+    ALIASES = {'application/x-msgpack': MSGPACK}
+
+    GZIP = 'gzip'
+    ZSTD = 'zstd'
+
+    EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self, json_encoder: JsonEncoder):
+        self.json_encoder = json_encoder
+        self.compression = True
+
+    def media_types(self) -> List[str]:
+        """ Returns available media types, the preferred first. """
+        result = [ResponseEncoder.JSON]
+        if msgpack is not None:
+            result.extend([ResponseEncoder.MSGPACK, 'application/x-msgpack'])
+        if cbor2 is not None:
+            result.append(ResponseEncoder.CBOR)
+        return result
+
+    def encodings(self) -> List[str]:
+        """ Returns available content encodings, the preferred first. """
+        if not self.compression:
+            return []
+        if zstandard is not None:
+            return [ResponseEncoder.ZSTD, ResponseEncoder.GZIP]
+        return [ResponseEncoder.GZIP]
+
+    def negotiate(self, lines: bool = False) -> Tuple[str, Optional[str]]:
+        """
+        Returns (media type, content encoding or None) for the current
+        request. NDJSON is offered if lines is True. JSON is used if no
+        offered media type is acceptable.
+        """
+        media_types = self.media_types()
+        if lines:
+            media_types.append(ResponseEncoder.NDJSON)
+        media_type = request.accept_mimetypes.best_match(
+            media_types, default=ResponseEncoder.JSON)
+        media_type = ResponseEncoder.ALIASES.get(media_type, media_type)
+        encoding = request.accept_encodings.best_match(self.encodings())
+        return media_type, encoding
+
+    def dumps(self, obj, media_type: str) -> bytes:
+        if media_type == ResponseEncoder.MSGPACK:
+            return msgpack.packb(obj, default=ResponseEncoder.__msgpack_default)
+        if media_type == ResponseEncoder.CBOR:
+            return cbor2.dumps(obj, datetime_as_timestamp=True,
+                               timezone=datetime.timezone.utc)
+        return self.json_encoder.dumps(obj)
+
+    def encode(self, obj, media_type: str, encoding: Optional[str]) -> bytes:
+        """ Returns body of obj in media_type compressed by encoding. """
+        return b''.join(self.compress([self.dumps(obj, media_type)], encoding))
+
+    @staticmethod
+    def compress(parts: Iterable[bytes],
+                 encoding: Optional[str]) -> Iterator[bytes]:
+        """ Yields parts of body compressed by encoding as they arrive. """
+        if encoding is None:
+            yield from parts
+            return
+
+        if encoding == ResponseEncoder.ZSTD:
+            compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        for part in parts:
+            chunk = compressor.compress(part)
+            if chunk:
+                yield chunk
+        yield compressor.flush()
+
+    @staticmethod
+    def make_response(body, media_type: str, encoding: Optional[str]):
+        """ Returns response of encoded body (bytes or iterator). """
+        response = current_app.response_class(body, mimetype=media_type)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept')
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def response(self, obj):
+        """ Returns response of obj in the negotiated format. """
+        media_type, encoding = self.negotiate()
+        return ResponseEncoder.make_response(
+            self.encode(obj, media_type, encoding), media_type, encoding)
+
+    def lines_response(self, items: Iterable, encoding: Optional[str]):
+        """
+        Returns NDJSON response streaming items as they are generated,
+        one JSON object per line.
+        """
+        body = ResponseEncoder.compress(
+            (self.json_encoder.dumps(item) for item in items), encoding)
+        return ResponseEncoder.make_response(
+            stream_with_context(body), ResponseEncoder.NDJSON, encoding)
+
+    @staticmethod
+    def __msgpack_default(obj):
+        if isinstance(obj, datetime.datetime):
+            return ResponseEncoder.__timestamp(obj)
+        raise TypeError(f'Object of type {type(obj).__name__} '
+                        f'is not MessagePack serializable')
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def __timestamp(date: datetime.datetime):
+        micro = (date - ResponseEncoder.EPOCH) // \
+            datetime.timedelta(microseconds=1)
+        return msgpack.Timestamp(micro // 10 ** 6, micro % 10 ** 6 * 1000)
+
+
+response_encoder = ResponseEncoder(json_encoder)
@@ -0,0 +1,272 @@
+import datetime
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class NodeRecord:
+    """
+    Compact in-memory copy of a row of table 'products'. Attributes are
+    named like Product columns, so records can be used instead of rows.
+    """
+    __slots__ = ('id', 'name', 'parent_id', 'type_id', 'price', 'count',
+                 'update_date', 'children')
+
+    FIELDS = ('id', 'name', 'parent_id', 'type_id', 'price', 'count',
+              'update_date')
+
+    def __init__(self, id: str, name: str, parent_id: Optional[str],
+                 type_id: int, price: int, count: int, update_date):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.type_id = type_id
+        self.price = price
+        self.count = count
+        self.update_date = update_date
+        self.children = []
+
+    @staticmethod
+    def from_row(row) -> 'NodeRecord':
+        return NodeRecord(*(getattr(row, field) for field in NodeRecord.FIELDS))
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, field) for field in NodeRecord.FIELDS)
+
+
+class ProductIndex:
+    """
+    In-process replica of table 'products': id -> NodeRecord plus lists
+    of children. Index does not query the database, it is loaded and
+    kept current by ProductTree. The database stays the source of truth.
+
+    Attributes:
+    -----------
+    nodes: dict
+        node id -> NodeRecord
+    loaded: bool
+        True if index contains the whole table and may answer reads
+    watermark: tuple
+        (the last id of 'statistics', removals) of the database included
+        in index (see models.TreeVersion), None if unknown
+    """
+    SNAPSHOT_MAGIC = b'PIDX\x02'
+
+    SNAPSHOT_COLUMNS = ('ids', 'names', 'parents', 'type_ids', 'prices',
+                        'counts', 'dates')
+
+    EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self):
+        self.nodes: Dict[str, NodeRecord] = dict()
+        self.loaded = False
+        self.watermark: Optional[Tuple[int, int]] = None
+        self.lock = threading.RLock()
+
+    def load(self, rows: Iterable) -> None:
+        """ Replaces content of index by rows of the whole table. """
+        with self.lock:
+            self.nodes = dict()
+            self.apply(rows)
+            self.loaded = True
+
+    def clear(self) -> None:
+        with self.lock:
+            self.nodes = dict()
+            self.loaded = False
+            self.watermark = None
+
+    def apply(self, rows: Iterable) -> None:
+        """ Inserts or replaces records of rows keeping children lists. """
+        with self.lock:
+            records = [NodeRecord.from_row(row) for row in rows]
+            for record in records:
+                old = self.nodes.get(record.id)
+                if old is not None:
+                    record.children = old.children
+                    self.__unlink(old)
+                self.nodes[record.id] = record
+
+            for record in records:
+                self.__link(record)
+
+    def remove(self, node_id: str) -> None:
+        """ Removes node_id with its subtree. """
+        with self.lock:
+            node = self.nodes.get(node_id)
+            if node is None:
+                return
+            self.__unlink(node)
+            for record in self.__walk(node):
+                del self.nodes[record.id]
+
+    def subtree(self, node_id: str) -> Optional[List[NodeRecord]]:
+        """
+        Returns records of subtree of node_id (node first, depth-first) or
+        None if index does not contain node_id.
+        """
+        with self.lock:
+            node = self.nodes.get(node_id)
+            if node is None:
+                return None
+            return list(self.__walk(node))
+
+    def diff(self, rows: Iterable) -> List[str]:
+        """
+        Compares index with rows of the whole table. Returns ids of nodes
+        whose records are missing, redundant or differ from rows.
+        """
+        with self.lock:
+            result = []
+            seen = set()
+            for row in rows:
+                seen.add(row.id)
+                record = self.nodes.get(row.id)
+                if record is None or \
+                        record.values() != NodeRecord.from_row(row).values():
+                    result.append(row.id)
+            result.extend(node_id for node_id in self.nodes
+                          if node_id not in seen)
+            return result
+
+    def save(self, file_path: str, watermark: Tuple[int, int]) -> None:
+        """
+        Writes index to snapshot file_path with watermark of the database
+        included in the index. File is replaced atomically.
+
+        Snapshot format: SNAPSHOT_MAGIC, length of JSON header (uint32),
+        JSON header, then columns one after another (see SNAPSHOT_COLUMNS):
+        utf-8 blobs of ids and names separated by NUL (it can not be
+        stored in PostgreSQL text) and arrays of fixed size items.
+        """
+        with self.lock:
+            records = list(self.nodes.values())
+            positions = {record.id: i for i, record in enumerate(records)}
+
+            columns = dict(
+                ids='\0'.join(record.id for record in records).encode(),
+                names='\0'.join(record.name for record in records).encode(),
+                parents=array('q', (positions.get(record.parent_id, -1)
+                                    for record in records)),
+                type_ids=array('b', (record.type_id for record in records)),
+                prices=array('q', (record.price for record in records)),
+                counts=array('q', (record.count for record in records)),
+                dates=array('q', (ProductIndex.__to_micro(record.update_date)
+                                  for record in records)))
+
+        header = dict(
+            size=len(records), statistic_id=watermark[0],
+            removals=watermark[1],
+            byteorder=sys.byteorder,
+            columns=[[name, len(columns[name]) * ProductIndex.__itemsize(
+                columns[name])] for name in ProductIndex.SNAPSHOT_COLUMNS])
+        header = json.dumps(header).encode()
+
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(ProductIndex.SNAPSHOT_MAGIC)
+            file.write(struct.pack('<I', len(header)))
+            file.write(header)
+            for name in ProductIndex.SNAPSHOT_COLUMNS:
+                file.write(columns[name])
+        os.replace(tmp_path, file_path)
+
+    def load_snapshot(self, file_path: str) -> Optional[Tuple[int, int]]:
+        """
+        Replaces content of index by memory-mapped snapshot file_path.
+        Returns watermark of snapshot or None if file is missing or not
+        valid. Loaded index must be brought up to date by the caller.
+        """
+        try:
+            file = open(file_path, 'rb')
+        except OSError:
+            return None
+
+        with file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic_size = len(ProductIndex.SNAPSHOT_MAGIC)
+            if mm[:magic_size] != ProductIndex.SNAPSHOT_MAGIC:
+                return None
+            header_size, = struct.unpack_from('<I', mm, magic_size)
+            start = magic_size + 4
+            header = json.loads(bytes(mm[start:start + header_size]))
+            if header['byteorder'] != sys.byteorder:
+                return None
+
+            view = memoryview(mm)
+            columns = dict()
+            try:
+                offset = start + header_size
+                for name, size in header['columns']:
+                    columns[name] = view[offset:offset + size]
+                    offset += size
+                self.__load_columns(header['size'], columns)
+            finally:
+                for column in columns.values():
+                    column.release()
+                view.release()
+
+        return header['statistic_id'], header['removals']
+
+    def __load_columns(self, size: int, columns: dict) -> None:
+        ids = str(columns['ids'], 'utf-8').split('\0')[:size]
+        names = str(columns['names'], 'utf-8').split('\0')[:size]
+        arrays = [columns[name].cast(code) for name, code in (
+            ('parents', 'q'), ('type_ids', 'b'), ('prices', 'q'),
+            ('counts', 'q'), ('dates', 'q'))]
+        parents, type_ids, prices, counts, dates = \
+            [column.tolist() for column in arrays]
+        for column in arrays:
+            column.release()
+
+        date_cache = {micro: ProductIndex.__from_micro(micro)
+                      for micro in set(dates)}
+        records = [NodeRecord(
+            node_id, name, ids[parent] if parent != -1 else None,
+            type_id, price, count, date_cache[micro]
+        ) for node_id, name, parent, type_id, price, count, micro in zip(
+            ids, names, parents, type_ids, prices, counts, dates)]
+
+        with self.lock:
+            self.nodes = {record.id: record for record in records}
+            for record in records:
+                if record.parent_id is not None:
+                    self.nodes[record.parent_id].children.append(record)
+            self.loaded = True
+
+    @staticmethod
+    def __itemsize(column) -> int:
+        return column.itemsize if isinstance(column, array) else 1
+
+    @staticmethod
+    def __to_micro(date: datetime.datetime) -> int:
+        return (date - ProductIndex.EPOCH) // datetime.timedelta(microseconds=1)
+
+    @staticmethod
+    def __from_micro(micro: int) -> datetime.datetime:
+        return ProductIndex.EPOCH + datetime.timedelta(microseconds=micro)
+
+    def __link(self, record: NodeRecord) -> None:
+        parent = self.nodes.get(record.parent_id)
+        if parent is not None:
+            parent.children.append(record)
+
+    def __unlink(self, record: NodeRecord) -> None:
+        parent = self.nodes.get(record.parent_id)
+        if parent is not None:
+            parent.children = [x for x in parent.children if x.id != record.id]
+
+    @staticmethod
+    def __walk(node: NodeRecord):
+        stack = [node]
+        while len(stack) != 0:
+            record = stack.pop()
+            yield record
+            stack.extend(reversed(record.children))
+
+
+product_index = ProductIndex()
@@ -0,0 +1,263 @@
+import datetime
+import itertools
+import multiprocessing
+import queue
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from app.api.utils import ValidationException, date_to_iso
+
+
+class TeeStream:
+    """ Binary stream copying all read data to file. """
+    def __init__(self, stream, file):
+        self.stream = stream
+        self.file = file
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.file.write(data)
+        return data
+
+
+class ImportJob:
+    """
+    Import queued for asynchronous applying.
+
+    Attributes:
+    -----------
+    id: str
+    status: str
+        one of QUEUED, RUNNING, DONE, FAILED
+    update_date: datetime.datetime
+    items: int
+        number of items in import
+    file:
+        temporary file with body of import
+    """
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+    def __init__(self, update_date, items: int, file):
+        self.id = str(uuid.uuid4())
+        self.status = ImportJob.QUEUED
+        self.update_date = update_date
+        self.items = items
+        self.file = file
+        self.stream = None
+        self.error = None
+
+    def to_dict(self) -> dict:
+        if self.status == ImportJob.DONE:
+            processed = self.items
+        elif self.stream is not None:
+            processed = self.stream.count
+        else:
+            processed = 0
+        return dict(
+            id=self.id, status=self.status,
+            updateDate=date_to_iso(self.update_date),
+            items=self.items, processed=processed, error=self.error)
+
+
+class QueuedCall:
+    """ Function called by the import worker in turn with imports. """
+    def __init__(self, func):
+        self.func = func
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ImportQueue:
+    """
+    Queue of asynchronous imports. Body of import is validated while it is
+    copied to a temporary file, then the import is applied by the worker
+    thread. Jobs are applied one by one in order of updateDate, because
+    statistics are written in order of increasing dates: jobs older than
+    the last started one are rejected. Deletes are run by the worker too
+    (see call), so they do not overtake imports accepted before them.
+
+    :param apply: function(job) applying import from job.file, it is
+        called in application context
+    """
+    # Number of finished jobs whose status is kept.
+    MAX_FINISHED = 1000
+
+    def __init__(self):
+        self.jobs = OrderedDict()
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        # updateDate of the last started job and the latest accepted one.
+        self.started_date = None
+        self.accepted_date = None
+        self.app = None
+        self.apply = None
+        self.worker = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.worker is not None
+
+    def start(self, app, apply) -> None:
+        self.app = app
+        self.apply = apply
+        self.worker = threading.Thread(
+            target=self.__run, name='import-worker', daemon=True)
+        self.worker.start()
+
+    def submit(self, stream, validate) -> ImportJob:
+        """
+        Validates import read from stream and queues it.
+
+        :param validate: function(stream) returning (update_date, items)
+            or raising ValidationException
+        """
+        file = tempfile.TemporaryFile()
+        try:
+            update_date, items = validate(TeeStream(stream, file))
+        except Exception:
+            file.close()
+            raise
+
+        with self.lock:
+            if self.started_date is not None and \
+                    update_date < self.started_date:
+                file.close()
+                raise ValidationException(
+                    'updateDate is older than the last applied import')
+            job = ImportJob(update_date, items, file)
+            self.jobs[job.id] = job
+            if self.accepted_date is None or update_date > self.accepted_date:
+                self.accepted_date = update_date
+            self.queue.put((update_date, next(self.counter), job))
+        return job
+
+    def call(self, func):
+        """
+        Calls func() in the worker after all imports accepted before and
+        returns its result or raises its exception.
+        """
+        call = QueuedCall(func)
+        with self.lock:
+            self.queue.put((self.accepted_date or datetime.datetime.min,
+                            next(self.counter), call))
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def __run(self) -> None:
+        while True:
+            _, _, job = self.queue.get()
+            if isinstance(job, QueuedCall):
+                self.__call(job)
+            else:
+                self.__apply(job)
+
+    def __apply(self, job: ImportJob) -> None:
+        with self.lock:
+            # Accepted while the previous job was being taken.
+            late = self.started_date is not None and \
+                job.update_date < self.started_date
+            if not late:
+                self.started_date = job.update_date
+        job.status = ImportJob.RUNNING
+        try:
+            if late:
+                raise ValidationException(
+                    'updateDate is older than the last applied import')
+            with self.app.app_context():
+                job.file.seek(0)
+                self.apply(job)
+                job.status = ImportJob.DONE
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.status = ImportJob.FAILED
+        finally:
+            job.file.close()
+            job.stream = None
+            self.__forget_finished()
+
+    def __call(self, call: QueuedCall) -> None:
+        try:
+            with self.app.app_context():
+                call.result = call.func()
+        except Exception as e:
+            call.error = e
+        finally:
+            call.done.set()
+
+    def __forget_finished(self) -> None:
+        with self.lock:
+            finished = [job_id for job_id, job in self.jobs.items()
+                        if job.status in (ImportJob.DONE, ImportJob.FAILED)]
+            for job_id in finished[:-ImportQueue.MAX_FINISHED]:
+                del self.jobs[job_id]
+
+
+import_queue = ImportQueue()
+
+
+class ValidationPool:
+    """
+    Process pool checking items of large imports by shards (see
+    ShopUnitImportStream). Results are returned in order of shards, so
+    the import is applied in the same order as without pool. Processes
+    are spawned, so functions run by them must be in modules importing
+    neither models nor the application (see validation).
+
+    Attributes:
+    -----------
+    processes: int
+        number of processes, 0 disables pool
+    threshold: int
+        number of first items of import checked in the request process;
+        smaller imports do not pay for IPC
+    """
+    def __init__(self):
+        self.processes = 0
+        self.threshold = 0
+        self.executor = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.executor is not None
+
+    def start(self, processes: int, threshold: int) -> None:
+        self.processes = processes
+        self.threshold = threshold
+        # Server threads may hold locks, so processes are not forked.
+        self.executor = ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context('spawn'))
+
+    def map(self, func, shards):
+        """
+        Yields func(*shard) for shards in their order. At most two shards
+        per process are submitted ahead of the consumer.
+        """
+        pending = deque()
+        try:
+            for shard in shards:
+                pending.append(self.executor.submit(func, *shard))
+                if len(pending) >= 2 * self.processes:
+                    yield pending.popleft().result()
+            while len(pending) != 0:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+validation_pool = ValidationPool()
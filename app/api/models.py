@@ -1,9 +1,23 @@
 import datetime
-from typing import List, Optional
-
-from sqlalchemy.orm import relationship
+import itertools
+import json
+import logging
+from typing import List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import bindparam, case, exists, false, func, insert, literal, \
+    or_, select, true, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, relationship
+from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy_serializer import SerializerMixin
-from app.api.utils import ProductType, is_cor_uuid, ValidationException, parse_iso, date_to_iso
+from app.api.cache import response_cache
+from app.api.index import NodeRecord, product_index
+from app.api.recent import recent_changes
+from app.api.sync import ChangeListener, change_notifier
+from app.api.utils import ProductType, ValidationException, parse_iso, date_to_iso, \
+    JsonStreamReader, decode_cursor, make_page
+from app.api.validation import ShopUnitImport, ShopUnitImportValidator
 from app.database import db
 
 
@@ -14,10 +28,18 @@ class Statistic(db.Model):
     """
     __tablename__ = 'statistics'
 
+    # Created in existing databases by migration c0ee30fbb9cd.
+    __table_args__ = (
+        db.Index('ix_statistics_product_id_update_date',
+                 'product_id', 'update_date'),
+        db.Index('ix_statistics_update_date', 'update_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
     product_id = db.Column(
-        db.String, db.ForeignKey(f'products.id'), nullable=False)
+        db.String, db.ForeignKey(f'products.id', ondelete='CASCADE'),
+        nullable=False)
 
     product = relationship(
         "Product", back_populates="statistic", cascade="all,delete")
@@ -34,9 +56,22 @@ class Statistic(db.Model):
 
     type_id = db.Column(db.Integer, nullable=False)
 
+    RAW = 'raw'
+    HOUR = 'hour'
+    DAY = 'day'
+    AUTO = 'auto'
+
+    RESOLUTIONS = (RAW, HOUR, DAY, AUTO)
+
+    # Longest periods served by resolution 'auto' from raw rows and from
+    # hourly rollups, longer periods are served from daily rollups.
+    AUTO_RAW_PERIOD = datetime.timedelta(days=1)
+    AUTO_HOUR_PERIOD = datetime.timedelta(days=14)
+
     @staticmethod
     def get(product_id, dateStart: Optional[datetime.datetime] = None,
-            dateEnd: Optional[datetime.datetime] = None) -> dict:
+            dateEnd: Optional[datetime.datetime] = None,
+            resolution: str = RAW) -> dict:
         """
         Return statistics for [dateStart, dateEnd). If dateStart or dateEnd
         is None, then returning statistics from all period.
@@ -44,6 +79,8 @@ class Statistic(db.Model):
         :param dateEnd: date of end period
         :param product_id: id of searching element
         :type product_id: type of Product.id
+        :param resolution: 'raw' for every snapshot, 'hour' or 'day' for
+            rollups (see StatisticRollup), 'auto' to choose by the period
         :return: {
             items=List[{
                 id: Statistic.product_id,
@@ -53,42 +90,475 @@ class Statistic(db.Model):
             }]
         }
         """
-        if dateStart is None or dateEnd is None:
-            res = db.session.query(Statistic). \
-                filter(Statistic.product_id == product_id).all()
+        source = Statistic.source(resolution, dateStart, dateEnd)
+        rows = source.query_rows(product_id, dateStart, dateEnd).all()
+        return {"items": [source.to_item(row) for row in rows]}
+
+    @staticmethod
+    def get_page(product_id, dateStart: Optional[datetime.datetime],
+                 dateEnd: Optional[datetime.datetime], limit: Optional[int],
+                 cursor: Optional[str] = None, resolution: str = RAW) -> dict:
+        """
+        Returns page of statistics like get: at most limit items after
+        cursor ordered by (update_date, id), and 'nextCursor' of the next
+        page or None.
+        """
+        source = Statistic.source(resolution, dateStart, dateEnd)
+        after = None if cursor is None else decode_cursor(cursor)
+        rows = source.query_rows(
+            product_id, dateStart, dateEnd, after,
+            None if limit is None else limit + 1)
+        return make_page(rows, limit, source.to_item)
+
+    @staticmethod
+    def iter_items(product_id, dateStart: Optional[datetime.datetime],
+                   dateEnd: Optional[datetime.datetime],
+                   limit: Optional[int] = None, cursor: Optional[str] = None,
+                   resolution: str = RAW):
+        """
+        Returns generator of items of get_page without collecting them,
+        rows are read by a server-side cursor.
+        """
+        source = Statistic.source(resolution, dateStart, dateEnd)
+        after = None if cursor is None else decode_cursor(cursor)
+        rows = source.query_rows(product_id, dateStart, dateEnd, after, limit)
+        return (source.to_item(row) for row in rows)
+
+    @staticmethod
+    def source(resolution: str, dateStart: Optional[datetime.datetime],
+               dateEnd: Optional[datetime.datetime]):
+        """
+        Returns model of rows of resolution: Statistic, HourlyStatistic or
+        DailyStatistic. If resolution is not valid then raised
+        ValidationException.
+        """
+        if resolution not in Statistic.RESOLUTIONS:
+            raise ValidationException
+        if resolution == Statistic.AUTO:
+            if dateStart is None or dateEnd is None or \
+                    dateEnd - dateStart > Statistic.AUTO_HOUR_PERIOD:
+                resolution = Statistic.DAY
+            elif dateEnd - dateStart > Statistic.AUTO_RAW_PERIOD:
+                resolution = Statistic.HOUR
+            else:
+                resolution = Statistic.RAW
+        return {Statistic.RAW: Statistic, Statistic.HOUR: HourlyStatistic,
+                Statistic.DAY: DailyStatistic}[resolution]
+
+    @staticmethod
+    def query_rows(product_id, dateStart: Optional[datetime.datetime] = None,
+                   dateEnd: Optional[datetime.datetime] = None, after=None,
+                   limit: Optional[int] = None):
+        """
+        Returns result of rows of statistics of product_id ordered by
+        (update_date, id) and following keyset after, if it is given.
+        Rows of columns are read without ORM objects.
+        """
+        query = select(
+            Statistic.id, Statistic.product_id, Statistic.name,
+            Statistic.update_date, Statistic.parent_id, Statistic.price,
+            Statistic.count, Statistic.type_id
+        ).where(Statistic.product_id == product_id). \
+            order_by(Statistic.update_date, Statistic.id). \
+            execution_options(stream_results=True, yield_per=1000)
+        if dateStart is not None and dateEnd is not None:
+            query = query.where(Statistic.update_date >= dateStart,
+                                Statistic.update_date < dateEnd)
+        if after is not None:
+            query = query.where(
+                tuple_(Statistic.update_date, Statistic.id) > tuple_(*after))
+        if limit is not None:
+            query = query.limit(limit)
+        return db.session.execute(query)
+
+    @staticmethod
+    def to_item(row) -> dict:
+        """ Converts row of statistics to item of response. """
+        return dict(
+            id=row.product_id, name=row.name, date=row.update_date,
+            parentId=row.parent_id,
+            price=None if row.count == 0 else row.price // row.count,
+            type=ProductType.get_type(row.type_id))
+
+
+class StatisticRollup:
+    """
+    Columns and queries of tables of rollups of 'statistics': one row per
+    node and bucket of time (see bucket), update_date is start of the
+    bucket. Prices are prices of responses (price // count, None if count
+    is 0): of the first and the last snapshot of the bucket (None if that
+    snapshot has no price), minimum, maximum, and sum with number of
+    snapshots with price for average. Name, parent and type are of the
+    last snapshot. Rows are maintained by Product.write_statistics as
+    snapshots are inserted.
+
+    Attributes:
+    -----------
+    TRUNCATED: dict
+        fields of datetime set to 0 in start of bucket, defined by tables
+    """
+    TRUNCATED: dict
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    @declared_attr
+    def product_id(cls):
+        return db.Column(
+            db.String, db.ForeignKey('products.id', ondelete='CASCADE'),
+            nullable=False)
+
+    update_date = db.Column(db.DateTime(), nullable=False)
+
+    name = db.Column(db.String, nullable=False)
+
+    parent_id = db.Column(db.String, nullable=True)
+
+    type_id = db.Column(db.Integer, nullable=False)
+
+    first_price = db.Column(db.Integer, nullable=True)
+
+    last_price = db.Column(db.Integer, nullable=True)
+
+    min_price = db.Column(db.Integer, nullable=True)
+
+    max_price = db.Column(db.Integer, nullable=True)
+
+    price_sum = db.Column(db.BigInteger, nullable=False)
+
+    samples = db.Column(db.Integer, nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (db.UniqueConstraint(
+            'product_id', 'update_date',
+            name=f'uq_{cls.__tablename__}_product_id_update_date'),)
+
+    @classmethod
+    def bucket(cls, date: datetime.datetime) -> datetime.datetime:
+        """ Returns start of bucket of date. """
+        return date.replace(**cls.TRUNCATED)
+
+    @classmethod
+    def write(cls, product_ids: List[str],
+              update_date: datetime.datetime) -> None:
+        """
+        Adds current rows of product_ids (all changed at update_date) to
+        their buckets by one INSERT ... ON CONFLICT DO UPDATE, or by reading
+        and writing rows if database backend has not it.
+        """
+        price = case((Product.count == 0, None),
+                     else_=Product.price / Product.count)
+        snapshots = select(
+            Product.id, literal(cls.bucket(update_date)), Product.name,
+            Product.parent_id, Product.type_id, price, price, price, price,
+            func.coalesce(price, 0),
+            case((Product.count == 0, 0), else_=1)
+        ).where(Product.id.in_(product_ids))
+        columns = ['product_id', 'update_date', 'name', 'parent_id',
+                   'type_id', 'first_price', 'last_price', 'min_price',
+                   'max_price', 'price_sum', 'samples']
+
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as upsert
         else:
-            res = db.session.query(Statistic).filter(
-                Statistic.product_id == product_id,
-                Statistic.update_date >= dateStart,
-                Statistic.update_date < dateEnd).all()
-
-        return {
-            "items": [dict(
-                id=el.parent_id, name=el.name,
-                date=date_to_iso(el.update_date),
-                parentId=el.parent_id,
-                price=None if el.count == 0 else el.price // el.count,
-                type=ProductType.get_type(el.type_id)
-            ) for el in res]
-        }
+            cls.__merge_rows(db.session.execute(snapshots).all())
+            return
+
+        stmt = upsert(cls.__table__).from_select(columns, snapshots)
+        table, new = cls.__table__.c, stmt.excluded
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.product_id, table.update_date],
+            set_=dict(
+                name=new.name, parent_id=new.parent_id, type_id=new.type_id,
+                last_price=new.last_price,
+                min_price=case(
+                    (table.min_price.is_(None), new.min_price),
+                    (new.min_price < table.min_price, new.min_price),
+                    else_=table.min_price),
+                max_price=case(
+                    (table.max_price.is_(None), new.max_price),
+                    (new.max_price > table.max_price, new.max_price),
+                    else_=table.max_price),
+                price_sum=table.price_sum + new.price_sum,
+                samples=table.samples + new.samples)))
+
+    @classmethod
+    def backfill(cls) -> None:
+        """
+        Fills empty table from 'statistics', for databases created before
+        the table. Snapshots are read in order of nodes and merged in
+        memory one node at a time.
+        """
+        if db.session.query(cls.id).first() is not None or \
+                db.session.query(Statistic.id).first() is None:
+            return
+
+        rows = db.session.execute(select(
+            Statistic.product_id, Statistic.update_date, Statistic.name,
+            Statistic.parent_id, Statistic.type_id, Statistic.price,
+            Statistic.count
+        ).order_by(Statistic.product_id, Statistic.update_date, Statistic.id).
+            execution_options(stream_results=True, yield_per=10_000))
+        for _, snapshots in itertools.groupby(rows, lambda row: row.product_id):
+            buckets = dict()
+            for row in snapshots:
+                price = None if row.count == 0 else row.price // row.count
+                cls.__merge(buckets, row.product_id, cls.bucket(
+                    row.update_date), row.name, row.parent_id, row.type_id,
+                    price)
+            db.session.execute(insert(cls), list(buckets.values()))
+        db.session.commit()
+
+    @classmethod
+    def __merge_rows(cls, snapshots) -> None:
+        """ Merges snapshots rows of select of write into existing rows. """
+        keys = {(row[0], row[1]) for row in snapshots}
+        existing = db.session.query(cls).filter(
+            cls.product_id.in_([key[0] for key in keys]),
+            cls.update_date.in_({key[1] for key in keys})).all()
+        buckets = {(row.product_id, row.update_date): dict(
+            (column, getattr(row, column)) for column in (
+                'product_id', 'update_date', 'name', 'parent_id', 'type_id',
+                'first_price', 'last_price', 'min_price', 'max_price',
+                'price_sum', 'samples')) for row in existing}
+        for row in existing:
+            db.session.delete(row)
+        db.session.flush()
+        for row in snapshots:
+            cls.__merge(buckets, *row[:6])
+        db.session.execute(insert(cls), list(buckets.values()))
+
+    @staticmethod
+    def __merge(buckets: dict, product_id: str, bucket: datetime.datetime,
+                name: str, parent_id: Optional[str], type_id: int,
+                price: Optional[int]) -> None:
+        """ Adds snapshot to dict (product_id, bucket) -> row of rollup. """
+        row = buckets.get((product_id, bucket))
+        if row is None:
+            row = buckets[(product_id, bucket)] = dict(
+                product_id=product_id, update_date=bucket, first_price=price,
+                min_price=None, max_price=None, price_sum=0, samples=0)
+        row.update(name=name, parent_id=parent_id, type_id=type_id,
+                   last_price=price)
+        if price is not None:
+            row['min_price'] = price if row['min_price'] is None else \
+                min(row['min_price'], price)
+            row['max_price'] = price if row['max_price'] is None else \
+                max(row['max_price'], price)
+            row['price_sum'] += price
+            row['samples'] += 1
+
+    @classmethod
+    def query_rows(cls, product_id, dateStart=None, dateEnd=None, after=None,
+                   limit: Optional[int] = None):
+        """
+        Returns result of rows of buckets of product_id intersecting
+        [dateStart, dateEnd) like Statistic.query_rows.
+        """
+        query = select(
+            cls.id, cls.product_id, cls.name, cls.update_date, cls.parent_id,
+            cls.type_id, cls.first_price, cls.last_price, cls.min_price,
+            cls.max_price, cls.price_sum, cls.samples
+        ).where(cls.product_id == product_id). \
+            order_by(cls.update_date, cls.id). \
+            execution_options(stream_results=True, yield_per=1000)
+        if dateStart is not None and dateEnd is not None:
+            query = query.where(cls.update_date >= cls.bucket(dateStart),
+                                cls.update_date < dateEnd)
+        if after is not None:
+            query = query.where(
+                tuple_(cls.update_date, cls.id) > tuple_(*after))
+        if limit is not None:
+            query = query.limit(limit)
+        return db.session.execute(query)
+
+    @staticmethod
+    def to_item(row) -> dict:
+        """
+        Converts row of rollup to item of response: item of Statistic with
+        average price and date of start of bucket, and also firstPrice,
+        lastPrice, minPrice and maxPrice.
+        """
+        return dict(
+            id=row.product_id, name=row.name, date=row.update_date,
+            parentId=row.parent_id,
+            price=None if row.samples == 0 else row.price_sum // row.samples,
+            type=ProductType.get_type(row.type_id),
+            firstPrice=row.first_price, lastPrice=row.last_price,
+            minPrice=row.min_price, maxPrice=row.max_price)
+
+
+class HourlyStatistic(StatisticRollup, db.Model):
+    """ Model for table 'statistics_hourly', rollups of hours. """
+    __tablename__ = 'statistics_hourly'
+
+    TRUNCATED = dict(minute=0, second=0, microsecond=0)
+
+
+class DailyStatistic(StatisticRollup, db.Model):
+    """ Model for table 'statistics_daily', rollups of days (UTC). """
+    __tablename__ = 'statistics_daily'
+
+    TRUNCATED = dict(hour=0, minute=0, second=0, microsecond=0)
+
+
+class OfferChange(db.Model):
+    """
+    Model for table 'offer_changes'. Table is appended by every import
+    with rows of changed offers, rows are deleted only with their
+    products. Index on update_date lets /sales read only changes of the
+    period instead of scanning 'products'.
+    """
+    __tablename__ = 'offer_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    product_id = db.Column(
+        db.String, db.ForeignKey('products.id', ondelete='CASCADE'),
+        nullable=False, index=True)
+
+    update_date = db.Column(db.DateTime(), nullable=False, index=True)
+
+    name = db.Column(db.String, nullable=False)
+
+    parent_id = db.Column(db.String, nullable=True)
+
+    price = db.Column(db.Integer, nullable=False)
+
+    @staticmethod
+    def write(products, update_date) -> None:
+        """ Appends changes of offers of products without commit. """
+        offer_id = ProductType.get_id(ProductType.OFFER)
+        rows = [dict(product_id=p.id, update_date=update_date, name=p.name,
+                     parent_id=p.parent_id, price=p.price)
+                for p in products if p.type_id == offer_id]
+        if len(rows) != 0:
+            db.session.execute(insert(OfferChange), rows)
+
+    @staticmethod
+    def query_latest(start_date: datetime.datetime,
+                     end_date: datetime.datetime, after=None,
+                     limit: Optional[int] = None):
+        """
+        Returns rows of the latest change of every offer changed in
+        [start_date, end_date] ordered by (update_date, id) and following
+        keyset after, if it is given. Changes are read from recent_changes
+        if it covers the period, otherwise by index on update_date and
+        a server-side cursor.
+        """
+        if recent_changes.enabled and recent_changes.covers(start_date):
+            rows = recent_changes.get(start_date, end_date)
+            latest = {row.product_id: row for row in rows}
+            rows = [row for row in rows if latest[row.product_id] is row and
+                    (after is None or (row.update_date, row.id) > after)]
+            return rows if limit is None else rows[:limit]
+
+        later = aliased(OfferChange)
+        query = OfferChange.__rows_query().where(
+            OfferChange.update_date >= start_date,
+            OfferChange.update_date <= end_date,
+            ~exists().where(
+                later.product_id == OfferChange.product_id,
+                later.update_date <= end_date,
+                tuple_(later.update_date, later.id) >
+                tuple_(OfferChange.update_date, OfferChange.id))). \
+            order_by(OfferChange.update_date, OfferChange.id). \
+            execution_options(stream_results=True, yield_per=1000)
+        if after is not None:
+            query = query.where(tuple_(OfferChange.update_date, OfferChange.id)
+                                > tuple_(*after))
+        if limit is not None:
+            query = query.limit(limit)
+        return db.session.execute(query)
+
+    @staticmethod
+    def load_recent() -> None:
+        """ Loads changes of the last RecentChanges.WINDOW to recent_changes. """
+        latest = db.session.query(func.max(OfferChange.update_date)).scalar()
+        horizon = datetime.datetime.min if latest is None else \
+            latest - recent_changes.WINDOW
+        rows = db.session.execute(OfferChange.__rows_query().where(
+            OfferChange.update_date >= horizon).order_by(OfferChange.id))
+        recent_changes.load(rows, horizon)
+
+    @staticmethod
+    def refresh_recent(product_ids) -> None:
+        """
+        Appends committed rows of product_ids since recent_changes.horizon
+        which are not in the buffer yet. Rows are read by products, not
+        after the last read id: transactions of other threads and
+        processes may commit rows with smaller ids later.
+        """
+        if recent_changes.horizon is None:
+            return
+        product_ids = list(product_ids)
+        chunk = ProductTree.UPSERT_CHUNK_SIZE
+        for i in range(0, len(product_ids), chunk):
+            rows = db.session.execute(OfferChange.__rows_query().where(
+                OfferChange.product_id.in_(product_ids[i:i + chunk]),
+                OfferChange.update_date >= recent_changes.horizon).
+                order_by(OfferChange.id))
+            recent_changes.add(rows)
+
+    @staticmethod
+    def backfill() -> None:
+        """
+        Fills empty table from statistics of offers, for databases created
+        before the table.
+        """
+        if db.session.query(OfferChange.id).first() is not None:
+            return
+        db.session.execute(insert(OfferChange).from_select(
+            ['product_id', 'update_date', 'name', 'parent_id', 'price'],
+            select(Statistic.product_id, Statistic.update_date,
+                   Statistic.name, Statistic.parent_id, Statistic.price).
+            where(Statistic.type_id == ProductType.get_id(ProductType.OFFER)).
+            order_by(Statistic.update_date, Statistic.id)))
+        db.session.commit()
+
+    @staticmethod
+    def __rows_query():
+        return select(OfferChange.id, OfferChange.product_id,
+                      OfferChange.update_date, OfferChange.name,
+                      OfferChange.parent_id, OfferChange.price)
 
 
 class Product(db.Model, SerializerMixin):
+    """
+    Model for table 'products'. Column 'path' is materialized path of the
+    node: ids from root to node, each followed by PATH_SEPARATOR. It has a
+    prefix index, so ancestors and subtree are got without recursion.
+    """
     __tablename__ = 'products'
 
+    PATH_SEPARATOR = '.'
+
+    # Path, depth and cascades are added to existing databases by
+    # migration 4b1f0e2a7d93, index on parent_id by migration 9e3d5b2c1a47.
+    __table_args__ = (
+        db.Index('ix_products_path', 'path',
+                 postgresql_ops={'path': 'varchar_pattern_ops'}),
+        db.Index('ix_products_parent_id_id', 'parent_id', 'id'),
+    )
+
     id = db.Column(db.String, primary_key=True)
 
     name = db.Column(db.String, nullable=False)
 
     parent_id = db.Column(
-        db.String, db.ForeignKey(f'{__tablename__}.id'),
+        db.String, db.ForeignKey(f'{__tablename__}.id', ondelete='CASCADE'),
         default=None, nullable=True, )
 
     statistic = relationship(
-        "Statistic", back_populates="product", cascade="all,delete")
+        "Statistic", back_populates="product", cascade="all,delete",
+        passive_deletes=True)
 
     children = relationship(
-        "Product", back_populates="parent", cascade="all, delete")
+        "Product", back_populates="parent", cascade="all, delete",
+        passive_deletes=True)
 
     parent = relationship(
         "Product", back_populates="children", remote_side=[id])
@@ -101,141 +571,251 @@ class Product(db.Model, SerializerMixin):
 
     update_date = db.Column(db.DateTime(), nullable=False)
 
-    def update_dict(self) -> dict:
-        """
-        Converts this object to dict. Result dict contains only fields whose
-        may be updated:
-            name, price, count, update_date, parent_id.
-        """
-        # TODO: remove this method and crete method update
-        return self.to_dict(
-            only=('name', 'price', 'count', 'update_date', 'parent_id'))
+    path = db.Column(db.String, nullable=False)
 
-    def get_statistic(self):
-        """ Convert this object ot Statistic object. """
-        return Statistic(
-            product_id=self.id, update_date=self.update_date,
-            name=self.name, price=self.price, type_id=self.type_id,
-            parent_id=self.parent_id, count=self.count)
+    depth = db.Column(db.Integer, nullable=False)
 
     @staticmethod
-    def write_statistics(date):
-        """ Inserts Products where update_date == date to table 'statistics'. """
-        updated = db.session.query(Product). \
-            filter(Product.update_date == date).all()
-        db.session.add_all([product.get_statistic() for product in updated])
-        db.session.commit()
+    def path_to_ids(path: str) -> List[str]:
+        """ Returns ids from root to node of materialized path. """
+        return path.split(Product.PATH_SEPARATOR)[:-1]
+
+    @staticmethod
+    def ids_to_path(ids) -> str:
+        """ Returns materialized path for ids from root to node. """
+        return ''.join(node_id + Product.PATH_SEPARATOR for node_id in ids)
+
+    @staticmethod
+    def write_statistics(product_ids, update_date) -> None:
+        """
+        Copies current rows of product_ids (all changed at update_date) to
+        table 'statistics' by INSERT ... SELECT on the server, rows are not
+        loaded, and adds them to hourly and daily rollups. Called by
+        imports before commit with ids of all changed nodes.
+        """
+        product_ids = list(product_ids)
+        chunk = ProductTree.UPSERT_CHUNK_SIZE
+        for i in range(0, len(product_ids), chunk):
+            ids = product_ids[i:i + chunk]
+            db.session.execute(insert(Statistic).from_select(
+                ['product_id', 'update_date', 'name', 'price', 'type_id',
+                 'parent_id', 'count'],
+                select(Product.id, Product.update_date, Product.name,
+                       Product.price, Product.type_id, Product.parent_id,
+                       Product.count).
+                where(Product.id.in_(ids))))
+            HourlyStatistic.write(ids, update_date)
+            DailyStatistic.write(ids, update_date)
 
     @staticmethod
     def get_from_period(start_date: datetime.datetime,
                         end_date: datetime.datetime) -> dict:
         """
-        Returns items where update_date in [start_date, end_date] and type == 'OFFER'.
+        Returns offers changed in [start_date, end_date] with their latest
+        change in the period, read from table 'offer_changes'.
         TODO: returns object of ShopUnitStatisticUnit
         :return dict : {
             'items': List[dict]
         }
         """
-        result = db.session.query(Product).filter(
-            Product.update_date >= start_date,
-            Product.update_date <= end_date,
-            Product.type_id == ProductType.get_id(ProductType.OFFER)
-        ).all()
-        return {
-            "items": [dict(
-                id=p.id, name=p.name, date=p.update_date, parentId=p.parent_id,
-                price=p.price, type=ProductType.get_type(p.type_id)
-            ) for p in result]
-        }
+        rows = OfferChange.query_latest(start_date, end_date)
+        return {"items": [Product.sale_to_item(row) for row in rows]}
 
+    @staticmethod
+    def get_from_period_page(start_date: datetime.datetime,
+                             end_date: datetime.datetime,
+                             limit: Optional[int],
+                             cursor: Optional[str] = None) -> dict:
+        """
+        Returns page of get_from_period: at most limit items after cursor
+        ordered by (date, id), and 'nextCursor' of the next page or None.
+        """
+        after = None if cursor is None else decode_cursor(cursor)
+        rows = OfferChange.query_latest(
+            start_date, end_date, after, None if limit is None else limit + 1)
+        return make_page(rows, limit, Product.sale_to_item)
 
-class ShopUnitImport:
-    """
-    Class for validate imports data.
+    @staticmethod
+    def iter_from_period(start_date: datetime.datetime,
+                         end_date: datetime.datetime,
+                         limit: Optional[int] = None,
+                         cursor: Optional[str] = None):
+        """ Returns generator of items of get_from_period_page. """
+        after = None if cursor is None else decode_cursor(cursor)
+        rows = OfferChange.query_latest(start_date, end_date, after, limit)
+        return (Product.sale_to_item(row) for row in rows)
 
-    Attributes:
-    -----------
-    id: str (uuid)
-        primary key in table 'products'
-    name: str
-        offer/category name
-    parent_id: str
-        foreign key in table 'products
-    price: int
-    type_id: int
-        type id from utils.ProductTypes
+    @staticmethod
+    def sale_to_item(row) -> dict:
+        """ Converts row of 'offer_changes' to item of /sales. """
+        return dict(
+            id=row.product_id, name=row.name, date=row.update_date,
+            parentId=row.parent_id, price=row.price, type=ProductType.OFFER)
+
+
+class ProductClosure(db.Model):
     """
-    def __init__(self, id: str, name: str, type: str,
-                 price: Optional[int] = None,
-                 parentId: Optional[str] = None):
-        """
-        Validate and set attributes for object. Validate parameters:
-            id -- must be uuid;
-            parentId -- must be uuid;
-            type -- must be in ['OFFER', 'CATEGORY'];
-            price -- must be None if type == 'CATEGORY' else must be int;
-            name -- must be not None.
-        If can not validate raised ValidationException.
-        """
-        if not is_cor_uuid(id):
-            raise ValidationException(f'Not correct uuid "{id}"')
+    Model for table 'product_closure'. Table contains all pairs
+    (ancestor, descendant) of the products tree and distance between them,
+    including pairs (node, node) with depth 0. Table is maintained only
+    if TREE_STRATEGY is 'closure'.
+    """
+    __tablename__ = 'product_closure'
 
-        if parentId is not None and not is_cor_uuid(parentId):
-            raise ValidationException('parentId must be None or uuid')
+    ancestor_id = db.Column(
+        db.String, db.ForeignKey('products.id', ondelete='CASCADE'),
+        primary_key=True)
 
-        if name is None:
-            raise ValidationException(f'Name must be not None')
+    descendant_id = db.Column(
+        db.String, db.ForeignKey('products.id', ondelete='CASCADE'),
+        primary_key=True, index=True)
 
-        if type not in ProductType.get_types():
-            raise ValidationException(f'Type must be in {ProductType.get_types()}')
+    depth = db.Column(db.Integer, nullable=False)
 
-        if type == ProductType.CATEGORY and price is not None:
-            raise ValidationException(f'CATEGORY must not has price')
 
-        if type == ProductType.OFFER and price is None:
-            raise ValidationException(f'OFFER must have price')
+class TreeVersion(db.Model):
+    """
+    Model for table 'tree_version' of one row. Column removals counts
+    transactions which deleted products. Imports are ordered by ids of
+    their 'statistics' rows, so (the last id of 'statistics', removals)
+    is a watermark of table 'products' used by snapshots of the index.
+    """
+    __tablename__ = 'tree_version'
+
+    ROW_ID = 1
 
-        self.id = id
-        self.name = name
-        self.type_id = ProductType.get_id(type)
-        self.parent_id = parentId
+    id = db.Column(db.Integer, primary_key=True)
 
+    removals = db.Column(db.BigInteger, nullable=False)
+
+    @staticmethod
+    def ensure() -> None:
+        """ Inserts the row if it is missing and commits. """
+        if db.session.get(TreeVersion, TreeVersion.ROW_ID) is not None:
+            return
+        db.session.add(TreeVersion(id=TreeVersion.ROW_ID, removals=0))
         try:
-            self.price = int(price) if price is not None else 0
-        except Exception:
-            raise ValidationException(f'Price must be "int"')
+            db.session.commit()
+        except IntegrityError:
+            # Inserted by another process.
+            db.session.rollback()
+
+    @staticmethod
+    def add_removal() -> int:
+        """ Increments removals without commit, returns the new value. """
+        row = TreeVersion.id == TreeVersion.ROW_ID
+        db.session.query(TreeVersion).filter(row).update(
+            {TreeVersion.removals: TreeVersion.removals + 1},
+            synchronize_session=False)
+        return db.session.query(TreeVersion.removals).filter(row).scalar()
 
-    def to_dict(self):
-        return self.__dict__
+    @staticmethod
+    def watermark() -> Tuple[int, int]:
+        """ Returns (the last id of 'statistics', removals). """
+        statistic_id = db.session.query(func.max(Statistic.id)).scalar()
+        removals = db.session.query(TreeVersion.removals). \
+            filter(TreeVersion.id == TreeVersion.ROW_ID).scalar()
+        return statistic_id or 0, removals or 0
 
 
-class ShopUnitImportRequest:
+class ShopUnitImportStream:
     """
-    Class for validate import data:
+    Class for validate import data read incrementally from JSON stream.
+    Items are validated and converted to Product by chunks, so memory
+    does not depend on size of import (except ids kept by validator).
 
     Attributes:
     ----------
-    items: List[ShopUnitImport]
-        ShopUnitImport elements for updating date
-    update_date: datetime.datetime
-        updating time
+    update_date: datetime.datetime or None
+        updating time, None while it is not read from stream
+    count: int
+        number of items read from stream
+    validator: ShopUnitImportValidator
+        validator of items read from stream
     """
-    def __init__(self, items: List, updateDate: str):
+    CHUNK_SIZE = 1000
+
+    def __init__(self, stream, chunk_size: int = CHUNK_SIZE, pool=None):
         """
-        Converts items to List[ShopUnitImport] and updateDate to datetime.datetime.
-        If can not validate raised ValidationException.
+        :param pool: jobs.ValidationPool or None. If pool is given, items
+            after its threshold are checked by its processes.
         """
-        try:
-            self.items = [ShopUnitImport(**item) for item in items]
-            self.update_date = parse_iso(updateDate)
-        except Exception:
-            raise ValidationException('Datetime not has ISO format')
+        self.reader = JsonStreamReader(stream)
+        self.chunk_size = chunk_size
+        self.pool = pool
+        self.update_date = None
+        self.count = 0
+        self.validator = ShopUnitImportValidator()
+
+    @property
+    def ids(self):
+        """ Ids of items read from stream, they are kept by validator. """
+        return self.validator.parents.keys()
+
+    def chunks(self):
+        """
+        Yields lists of at most chunk_size Products. Products of chunks
+        read before updateDate have update_date None. If data can not be
+        validated raised ValidationException.
+        """
+        keys = set()
+        for key, value in self.reader.object_items(array_keys=('items',)):
+            if key in keys or key not in ('items', 'updateDate'):
+                raise ValidationException(f'Unexpected key "{key}"')
+            keys.add(key)
+
+            if key == 'updateDate':
+                try:
+                    self.update_date = parse_iso(value)
+                except Exception:
+                    raise ValidationException('Datetime not has ISO format')
+                continue
+
+            chunk = []
+            for unit in self.__units(value):
+                self.validator.add(unit)
+                chunk.append(Product(
+                    update_date=self.update_date, **unit.to_dict()))
+                self.count += 1
+                if len(chunk) == self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if len(chunk) != 0:
+                yield chunk
+
+        if len(keys) != 2:
+            raise ValidationException('Import must have items and updateDate')
+
+    def __units(self, items):
+        """
+        Yields ShopUnitImport of items in their order. Items after
+        threshold of pool are checked by processes of pool by shards of
+        chunk_size items.
+        """
+        index = 0
+        for item in items:
+            yield ShopUnitImportValidator.check_item(item, index)
+            index += 1
+            if self.pool is not None and index >= self.pool.threshold:
+                break
+        else:
+            return
+
+        shards = ShopUnitImportStream.__shards(items, self.chunk_size, index)
+        for units in self.pool.map(ShopUnitImportValidator.check_items, shards):
+            yield from units
 
-    def get_products_list(self) -> List[Product]:
-        """ Converts self to List[Product] and returns him. """
-        return [Product(
-            update_date=self.update_date, **item.to_dict()
-        ) for item in self.items]
+    @staticmethod
+    def __shards(items, size: int, first_index: int):
+        shard = []
+        for item in items:
+            shard.append(item)
+            if len(shard) == size:
+                yield shard, first_index
+                first_index += size
+                shard = []
+        if len(shard) != 0:
+            yield shard, first_index
 
 
 class NodeExistException(Exception):
@@ -250,57 +830,504 @@ class NodeTypeError(Exception):
     pass
 
 
+class ParentNotFoundException(ValidationException):
+    pass
+
+
+class AncestorDeltas:
+    """
+    Accumulates price/count changes of the tree ancestors in memory.
+
+    The part of the tree above the changed nodes is loaded once, all
+    changes of a batch are summed per ancestor and then written to the
+    database with one statement (see ProductTree.apply_deltas).
+
+    Attributes:
+    -----------
+    parents: dict
+        node id -> parent id for every loaded node
+    aggregates: dict
+        node id -> [price, count] as stored in the database
+    types: dict
+        node id -> type_id for every node loaded from the database
+    paths: dict
+        node id -> materialized path for every node loaded from the database
+    deltas: dict
+        node id -> [price_delta, count_delta] for every touched ancestor
+    """
+    def __init__(self, rows=()):
+        self.parents = dict()
+        self.aggregates = dict()
+        self.types = dict()
+        self.paths = dict()
+        self.deltas = dict()
+        for row in rows:
+            self.parents[row.id] = row.parent_id
+            self.aggregates[row.id] = [row.price, row.count]
+            self.types[row.id] = row.type_id
+            self.paths[row.id] = row.path
+
+    def add_node(self, node_id: str, parent_id: Optional[str],
+                 price: int = 0, count: int = 0) -> None:
+        """ Registers a node which is not stored in the database yet. """
+        self.parents[node_id] = parent_id
+        self.aggregates[node_id] = [price, count]
+
+    def set_parent(self, node_id: str, parent_id: Optional[str]) -> None:
+        self.parents[node_id] = parent_id
+
+    def current(self, node_id: str) -> List[int]:
+        """ Returns [price, count] of node with all accumulated deltas. """
+        price, count = self.aggregates[node_id]
+        price_delta, count_delta = self.deltas.get(node_id, (0, 0))
+        return [price + price_delta, count + count_delta]
+
+    def add(self, node_id: Optional[str], price_delta: int = 0,
+            count_delta: int = 0) -> None:
+        """
+        Adds deltas to all nodes on the way from node_id to root. Unknown
+        node_id is ignored (like a missing parent in the database).
+        """
+        for node_id in self.__way_to_root(node_id):
+            if node_id not in self.parents:
+                break
+            delta = self.deltas.setdefault(node_id, [0, 0])
+            delta[0] += price_delta
+            delta[1] += count_delta
+
+    def path(self, node_id: str) -> str:
+        """ Returns materialized path of node_id with current parents. """
+        return Product.ids_to_path(reversed(list(self.__way_to_root(node_id))))
+
+    def __way_to_root(self, node_id: Optional[str]):
+        """
+        Yields node_id and all its ancestors. If parents contain a cycle
+        then raised ValidationException. Parents must be checked before:
+        the way ends at a node which is not loaded.
+        """
+        seen = set()
+        while node_id is not None:
+            if node_id in seen:
+                raise ValidationException('Parents contain a cycle')
+            seen.add(node_id)
+            yield node_id
+            node_id = self.parents.get(node_id)
+
+
 class ProductTree:
-    """ Class for working with Product model as with tree. """
+    """
+    Class for working with Product model as with tree.
+
+    Subtree and ancestors are queried by one of strategies selected by
+    config TREE_STRATEGY:
+        CTE -- recursive CTE by parent_id;
+        PATH -- prefix search by materialized path (default);
+        CLOSURE -- join with table 'product_closure'.
+    Materialized path is maintained with any strategy.
+
+    If config TREE_INDEX is set, the whole table is also kept in the
+    process memory (see index.ProductIndex) and subtrees are read from it.
+    Responses of subtrees may be cached (see cache.ResponseCache); both
+    are updated after commit of each change.
+    """
+
+    CTE = 'cte'
+    PATH = 'path'
+    CLOSURE = 'closure'
+
+    UPSERT_CHUNK_SIZE = 1000
+
+    JSON_PART_SIZE = 64 * 1024
+
+    # update_date of streamed products written before updateDate is read.
+    PENDING_DATE = datetime.datetime(1, 1, 1)
+
+    @staticmethod
+    def strategy() -> str:
+        return current_app.config.get('TREE_STRATEGY', ProductTree.PATH)
+
+    @staticmethod
+    def load_index() -> None:
+        """ Loads the whole table 'products' to product_index. """
+        # Watermark is read first: changes committed while the table is
+        # read are only replayed once more by the next warm start.
+        watermark = TreeVersion.watermark()
+        with product_index.lock:
+            product_index.load(ProductTree.__index_query().all())
+            product_index.watermark = watermark
+
+    @staticmethod
+    def warm_start_index(file_path: str, check: bool = True) -> None:
+        """
+        Loads product_index from snapshot file_path and replays rows of
+        'statistics' after its watermark (see TreeVersion). If snapshot is
+        missing, or products were deleted after it was written (deletes
+        are not replayed), the whole table is loaded. If check then the
+        index is compared with the table and loaded again if they differ.
+        """
+        watermark = product_index.load_snapshot(file_path)
+        current = TreeVersion.watermark()
+        if watermark is None or watermark[1] != current[1] or \
+                watermark[0] > current[0]:
+            ProductTree.load_index()
+            return
+
+        rows = db.session.query(
+            Statistic.product_id.label('id'), Statistic.name,
+            Statistic.parent_id, Statistic.type_id, Statistic.price,
+            Statistic.count, Statistic.update_date). \
+            filter(Statistic.id > watermark[0]). \
+            order_by(Statistic.id).all()
+        with product_index.lock:
+            product_index.apply({row.id: row for row in rows}.values())
+            product_index.watermark = current
+
+        if check:
+            wrong_ids = ProductTree.check_index(repair=False)
+            if len(wrong_ids) != 0:
+                logging.getLogger(__name__).warning(
+                    'Snapshot %s differs from products in %d nodes, '
+                    'loading the whole table', file_path, len(wrong_ids))
+                ProductTree.load_index()
+
+    @staticmethod
+    def save_index_snapshot(file_path: str) -> None:
+        """ Writes product_index to snapshot file_path with its watermark. """
+        with product_index.lock:
+            if not product_index.loaded or product_index.watermark is None:
+                return
+            product_index.save(file_path, product_index.watermark)
+
+    @staticmethod
+    def check_index(repair: bool = True) -> List[str]:
+        """
+        Compares product_index with table 'products'. Returns ids of nodes
+        whose records differ; if repair then they are reloaded.
+        """
+        with product_index.lock:
+            wrong_ids = product_index.diff(ProductTree.__index_query().all())
+            if repair and len(wrong_ids) != 0:
+                ProductTree.__refresh_index(wrong_ids)
+        return wrong_ids
+
+    @staticmethod
+    def __index_query():
+        """ Returns query of columns of Product stored in product_index. """
+        return db.session.query(
+            *(getattr(Product, field) for field in NodeRecord.FIELDS))
+
+    @staticmethod
+    def __refresh_index(node_ids) -> None:
+        """
+        Reloads nodes node_ids to product_index from the database. Nodes
+        which are not found are removed from index.
+        """
+        if not product_index.loaded:
+            return
+        node_ids = set(node_ids)
+        with product_index.lock:
+            rows = ProductTree.__index_query(). \
+                filter(Product.id.in_(list(node_ids))).all()
+            product_index.apply(rows)
+            for node_id in node_ids.difference(row.id for row in rows):
+                product_index.remove(node_id)
 
     @staticmethod
     def get_subtree(node_id):
         """ Returns nested dict like subtree for node where root is node_id. """
-        nodes_list = ProductTree.__subtree_query(node_id).all()
-
-        res_nodes = dict()
-        for node in nodes_list:
-            res_nodes[node.id] = dict(
-                id=node.id, name=node.name, parentId=node.parent_id,
-                date=date_to_iso(node.update_date), type=ProductType.get_type(node.type_id))
-
-            price = None
-            if node.count != 0:
-                if node.type_id == ProductType.get_id(ProductType.OFFER):
-                    price = node.price
-                else:
-                    price = node.price // node.count
+        result_dict = ProductTree.get_subtrees([node_id])[node_id]
+        if result_dict is None:
+            raise NodeNotFoundException(f'Database not contains node {node_id}')
 
-            res_nodes[node.id]['price'] = price
+        return result_dict
 
-            res_nodes[node.id]['children'] = [] \
-                if node.type_id == ProductType.get_id(ProductType.CATEGORY) else None
+    @staticmethod
+    def get_subtrees(node_ids: List[str]) -> dict:
+        """
+        Returns dict node id -> nested dict like subtree of node (None if
+        database does not contain node) for all node_ids. All subtrees are
+        read by one query, subtrees of nodes lying in subtree of another
+        requested node are read once.
+        """
+        if product_index.loaded:
+            records = dict()
+            for node_id in node_ids:
+                if node_id not in records:
+                    records.update((record.id, record) for record in
+                                   product_index.subtree(node_id) or [])
+            nodes_list = records.values()
+        else:
+            nodes_list = db.session.execute(
+                ProductTree.__subtree_query(node_ids)).all()
 
-        result_dict = res_nodes.pop(node_id)
-        while len(res_nodes) != 0:
-            x = res_nodes.popitem()[1]
-            if x['parentId'] == node_id:
-                result_dict['children'].append(x)
-            else:
+        res_nodes = {node.id: ProductTree.node_to_dict(node)
+                     for node in nodes_list}
+
+        for x in res_nodes.values():
+            if x['parentId'] in res_nodes:
                 res_nodes[x['parentId']]['children'].append(x)
 
-        return result_dict
+        return {node_id: res_nodes.get(node_id) for node_id in node_ids}
 
     @staticmethod
-    def has_node(node_id: str) -> bool:
-        return ProductTree.get_node(node_id) is not None
+    def iter_subtree_json(node_id: str, ensure_ascii: bool = True):
+        """
+        Returns generator of parts of JSON of subtree of node_id, equal to
+        jsonify(get_subtree(node_id)) with sorted keys. Rows are read in
+        depth-first order and written as they arrive, so neither subtree
+        nor JSON is built in memory. If database does not contain node_id
+        then raised NodeNotFoundException before the first part.
+        """
+        rows = ProductTree.__depth_first_rows(node_id)
+        root = next(rows, None)
+        if root is None:
+            raise NodeNotFoundException(f'Database not contains node {node_id}')
+
+        return ProductTree.__subtree_json(
+            itertools.chain([root], rows), ensure_ascii)
 
     @staticmethod
-    def get_node(node_id: str) -> Product or None:
-        return db.session.query(Product).filter(Product.id == node_id).one_or_none()
+    def __depth_first_rows(node_id: str):
+        """
+        Yields rows of subtree of node_id: every node is followed by its
+        subtree. Rows are read by a server-side cursor ordered by path.
+        """
+        if product_index.loaded:
+            yield from product_index.subtree(node_id) or []
+            return
+
+        path = db.session.query(Product.path). \
+            filter(Product.id == node_id).scalar()
+        if path is None:
+            return
+
+        order = Product.path
+        if db.engine.dialect.name == 'postgresql':
+            order = Product.path.collate('C')
+
+        query = select(*(getattr(Product, field)
+                         for field in NodeRecord.FIELDS)). \
+            where(Product.path.startswith(path, autoescape=True)). \
+            order_by(order). \
+            execution_options(stream_results=True, yield_per=1000)
+        yield from db.session.execute(query)
 
     @staticmethod
-    def __add_nodes(products: List[Product]) -> None:
+    def __subtree_json(rows, ensure_ascii: bool):
+        """ Writes depth-first rows as JSON by parts of about 64 KB. """
+        def fields(node) -> str:
+            node_dict = ProductTree.node_to_dict(node)
+            node_dict['date'] = date_to_iso(node.update_date)
+            del node_dict['children']
+            return ','.join(
+                json.dumps(key) + ':' +
+                json.dumps(value, ensure_ascii=ensure_ascii)
+                for key, value in sorted(node_dict.items()))
+
+        parts = []
+        size = 0
+        # Open categories: [id, fields, has written children].
+        stack = []
+        open_ids = set()
+        for i, row in enumerate(rows):
+            if i != 0 and row.parent_id not in open_ids:
+                # Children of offers are not part of the tree, imports
+                # reject them; the response must stay valid JSON anyway.
+                continue
+            while len(stack) != 0 and stack[-1][0] != row.parent_id:
+                category_id, category_fields, _ = stack.pop()
+                open_ids.discard(category_id)
+                parts.append('],' + category_fields + '}')
+            if len(stack) != 0:
+                if stack[-1][2]:
+                    parts.append(',')
+                stack[-1][2] = True
+
+            if row.type_id == ProductType.get_id(ProductType.CATEGORY):
+                parts.append('{"children":[')
+                stack.append([row.id, fields(row), False])
+                open_ids.add(row.id)
+            else:
+                parts.append('{"children":null,' + fields(row) + '}')
+
+            size += len(parts[-1])
+            if size >= ProductTree.JSON_PART_SIZE:
+                yield ''.join(parts)
+                parts = []
+                size = 0
+
+        while len(stack) != 0:
+            parts.append('],' + stack.pop()[1] + '}')
+        parts.append('\n')
+        yield ''.join(parts)
+
+    @staticmethod
+    def get_subtree_page(node_id: str, depth: Optional[int] = None,
+                         limit: Optional[int] = None,
+                         cursor: Optional[str] = None) -> dict:
+        """
+        Returns nested dict like subtree of node_id cut by depth (levels
+        below node) with at most limit children of every category, ordered
+        by id. cursor is the last id of the previous page of children of
+        node_id. Categories also have 'childrenCount' (all children) and,
+        if they have more children than returned, 'nextCursor'. Prices of
+        categories are aggregates of the whole subtree.
+
+        Children are read level by level only for returned categories: at
+        most limit + 1 children of each of them by index on parent_id.
+        """
+        if product_index.loaded:
+            return ProductTree.__page_from_index(node_id, depth, limit, cursor)
+
+        columns = [getattr(Product, field) for field in NodeRecord.FIELDS]
+        root = db.session.query(*columns).filter(
+            Product.id == node_id).one_or_none()
+        if root is None:
+            raise NodeNotFoundException(f'Database not contains node {node_id}')
+
+        category_id = ProductType.get_id(ProductType.CATEGORY)
+        rows = []
+        counts = dict()
+        parents = [root] if root.type_id == category_id else []
+        level_depth = 0
+        while len(parents) != 0:
+            parent_ids = [parent.id for parent in parents]
+            counts.update(ProductTree.__children_counts(parent_ids))
+            if depth is not None and level_depth == depth:
+                break
+
+            children = ProductTree.__children_rows(
+                parent_ids, limit, cursor if level_depth == 0 else None)
+            rows.extend(children)
+            parents = [row for row in children if row.type_id == category_id
+                       and (limit is None or row.rank <= limit)]
+            level_depth += 1
+
+        return ProductTree.__build_page(root, rows, counts, limit)
+
+    @staticmethod
+    def __children_rows(parent_ids: List[str], limit: Optional[int],
+                        cursor: Optional[str]) -> list:
+        """
+        Returns rows of at most limit + 1 children with id greater than
+        cursor of every node of parent_ids, ordered by (parent_id, id),
+        with their 'rank' among children.
+        """
+        columns = [getattr(Product, field) for field in NodeRecord.FIELDS]
+        result = []
+        chunk = ProductTree.UPSERT_CHUNK_SIZE
+        for i in range(0, len(parent_ids), chunk):
+            ranked = select(*columns, func.row_number().over(
+                partition_by=Product.parent_id,
+                order_by=Product.id).label('rank')). \
+                where(Product.parent_id.in_(parent_ids[i:i + chunk]))
+            if cursor is not None:
+                ranked = ranked.where(Product.id > cursor)
+            ranked = ranked.subquery()
+            query = select(ranked)
+            if limit is not None:
+                query = query.where(ranked.c.rank <= limit + 1)
+            result.extend(db.session.execute(
+                query.order_by(ranked.c.parent_id, ranked.c.id)).all())
+        return result
+
+    @staticmethod
+    def __children_counts(parent_ids: List[str]) -> dict:
+        """ Returns dict id -> number of children for nodes parent_ids. """
+        result = dict()
+        chunk = ProductTree.UPSERT_CHUNK_SIZE
+        for i in range(0, len(parent_ids), chunk):
+            result.update(db.session.query(Product.parent_id, func.count()).
+                          filter(Product.parent_id.in_(
+                              parent_ids[i:i + chunk])).
+                          group_by(Product.parent_id).all())
+        return result
+
+    @staticmethod
+    def __page_from_index(node_id: str, depth: Optional[int],
+                          limit: Optional[int], cursor: Optional[str]) -> dict:
+        """ get_subtree_page by product_index. """
+        with product_index.lock:
+            root = product_index.nodes.get(node_id)
+            if root is None:
+                raise NodeNotFoundException(
+                    f'Database not contains node {node_id}')
+
+            rows = []
+            counts = dict()
+            level = [root]
+            level_depth = 0
+            while len(level) != 0 and (depth is None or level_depth < depth):
+                next_level = []
+                for node in level:
+                    counts[node.id] = len(node.children)
+                    children = sorted(node.children, key=lambda x: x.id)
+                    if node is root and cursor is not None:
+                        children = [x for x in children if x.id > cursor]
+                    if limit is not None:
+                        children = children[:limit + 1]
+                    rows.extend(children)
+                    next_level.extend(children[:limit])
+                level = next_level
+                level_depth += 1
+
+            for node in level:
+                counts[node.id] = len(node.children)
+
+        rows.sort(key=lambda x: x.id)
+        return ProductTree.__build_page(root, rows, counts, limit)
+
+    @staticmethod
+    def __build_page(root, rows, counts: dict, limit: Optional[int]) -> dict:
+        """
+        Builds nested dict from root and rows ordered by id. Children over
+        limit and rows whose parent is not returned are dropped.
         """
-        Adds products in database table and updates all nodes whose contains the way
-        from node to root. If product already in table then raised database exception.
+        children = dict()
+        for row in rows:
+            children.setdefault(row.parent_id, []).append(row)
+
+        def to_dict(node) -> dict:
+            result = ProductTree.node_to_dict(node)
+            if result['children'] is None:
+                return result
+            result['childrenCount'] = counts.get(node.id, 0)
+            node_children = children.get(node.id, [])
+            if limit is not None and len(node_children) > limit:
+                node_children = node_children[:limit]
+                result['nextCursor'] = node_children[-1].id
+            result['children'] = [to_dict(x) for x in node_children]
+            return result
+
+        return to_dict(root)
+
+    @staticmethod
+    def node_to_dict(node) -> dict:
+        """
+        Converts row of Product (or NodeRecord) to dict of response
+        without children. Date is left datetime, encoders of responses
+        format it.
+        """
+        price = None
+        if node.count != 0:
+            if node.type_id == ProductType.get_id(ProductType.OFFER):
+                price = node.price
+            else:
+                price = node.price // node.count
 
-        WARNING: If exception is raised then changes not be committed.
+        return dict(
+            id=node.id, name=node.name, parentId=node.parent_id,
+            date=node.update_date,
+            type=ProductType.get_type(node.type_id), price=price,
+            children=[] if node.type_id == ProductType.get_id(
+                ProductType.CATEGORY) else None)
+
+    @staticmethod
+    def __add_nodes(products: List[Product], deltas: AncestorDeltas) -> None:
+        """
+        Prepares new products for inserting and collects changes of all nodes
+        whose contains the way from node to root. Products are written to the
+        database by __upsert_nodes.
         """
         for product in products:
             if product.type_id == ProductType.get_id(ProductType.OFFER):
@@ -308,8 +1335,7 @@ class ProductTree:
             else:
                 product.count = 0
                 product.price = 0
-
-        db.session.add_all(products)
+            deltas.add_node(product.id, product.parent_id)
 
         for product in products:
             price_delta = product.price
@@ -318,119 +1344,340 @@ class ProductTree:
                 count_delta = 0
                 price_delta = 0
 
-            ProductTree.__update_from_this_to_root(
-                product.parent_id, product.update_date, price_delta, count_delta)
-        db.session.commit()
+            deltas.add(product.parent_id, price_delta, count_delta)
+
+    @staticmethod
+    def __from_this_to_root_query(node_ids: List[str]):
+        """
+        Returns rows (id, parent_id, price, count, type_id, path) for
+        nodes node_ids and all their ancestors.
+        """
+        columns = (Product.id, Product.parent_id, Product.price,
+                   Product.count, Product.type_id, Product.path)
+
+        if ProductTree.strategy() == ProductTree.CTE:
+            top_query = db.session.query(*columns). \
+                filter(Product.id.in_(node_ids)). \
+                cte('cte', recursive=True)
+
+            bot_query = db.session.query(*columns). \
+                join(top_query, Product.id == top_query.c.parent_id)
+
+            return db.session.query(top_query.union(bot_query)).all()
+
+        if ProductTree.strategy() == ProductTree.CLOSURE:
+            return db.session.query(*columns).distinct(). \
+                join(ProductClosure, Product.id == ProductClosure.ancestor_id). \
+                filter(ProductClosure.descendant_id.in_(node_ids)).all()
+
+        nodes = db.session.query(*columns). \
+            filter(Product.id.in_(node_ids)).all()
+
+        ancestor_ids = {node_id for node in nodes
+                        for node_id in Product.path_to_ids(node.path)}
+        ancestor_ids.difference_update(node.id for node in nodes)
+
+        if len(ancestor_ids) == 0:
+            return nodes
+        return nodes + db.session.query(*columns). \
+            filter(Product.id.in_(list(ancestor_ids))).all()
+
+    @staticmethod
+    def __subtree_query(node_ids: List[str]):
+        """
+        Returns select of columns of NodeRecord.FIELDS of all products in
+        subtrees of node_ids.
+        """
+        columns = [getattr(Product, field) for field in NodeRecord.FIELDS]
+
+        if ProductTree.strategy() == ProductTree.CTE:
+            top_query = select(*columns). \
+                where(Product.id.in_(node_ids)). \
+                cte('cte', recursive=True)
+
+            bot_query = select(*columns). \
+                join(top_query, Product.parent_id == top_query.c.id)
+
+            return select(top_query.union(bot_query))
+
+        if ProductTree.strategy() == ProductTree.CLOSURE:
+            return select(*columns).where(Product.id.in_(
+                select(ProductClosure.descendant_id).
+                where(ProductClosure.ancestor_id.in_(node_ids))))
+
+        paths = sorted((row.path for row in db.session.query(Product.path).
+                        filter(Product.id.in_(node_ids))), key=len)
+
+        roots = []
+        for path in paths:
+            if not any(path.startswith(root) for root in roots):
+                roots.append(path)
+
+        return select(*columns).where(or_(false(), *(
+            Product.path.startswith(path, autoescape=True) for path in roots)))
 
     @staticmethod
-    def __from_this_to_root_query(node_id: str):
-        #  TODO: like __subtree_query
-        top_query = db.session.query(Product). \
-            filter(Product.id == node_id). \
-            cte('cte', recursive=True)
+    def __insert_closure(products: List[Product]) -> None:
+        """ Inserts closure rows of new products by their paths. """
+        rows = []
+        for product in products:
+            ids = Product.path_to_ids(product.path)
+            rows.extend(dict(
+                ancestor_id=ancestor_id, descendant_id=product.id,
+                depth=len(ids) - 1 - i) for i, ancestor_id in enumerate(ids))
 
-        bot_query = db.session.query(Product). \
-            join(top_query, Product.id == top_query.c.parent_id)
+        if len(rows) != 0:
+            db.session.execute(ProductClosure.__table__.insert(), rows)
 
-        return db.session.query(Product). \
-            select_entity_from(top_query.union(bot_query))
+    @staticmethod
+    def __move_closure(moved: List[Product]) -> None:
+        """
+        Replaces closure rows of subtrees of moved products: rows whose
+        ancestor is not in the new path of descendant or is an ancestor of
+        the moved product are deleted, then rows with all ancestors of the
+        moved product are inserted. Materialized paths of all moved
+        products must be already updated, so rows are right even if one
+        import reverses an ancestor relationship.
+        """
+        separator = Product.PATH_SEPARATOR
+        for product in moved:
+            subtree = select(Product.id).where(
+                Product.path.startswith(product.path, autoescape=True))
+            ancestor_ids = Product.path_to_ids(product.path)[:-1]
+
+            in_path = exists().where(
+                Product.id == ProductClosure.descendant_id,
+                (literal(separator) + Product.path).contains(
+                    literal(separator) + ProductClosure.ancestor_id +
+                    separator))
+            db.session.query(ProductClosure).filter(
+                ProductClosure.descendant_id.in_(subtree),
+                or_(~in_path, ProductClosure.ancestor_id.in_(ancestor_ids))). \
+                delete(synchronize_session=False)
+
+            if len(ancestor_ids) == 0:
+                continue
+
+            ancestor = aliased(Product)
+            db.session.execute(ProductClosure.__table__.insert().from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(ancestor.id, Product.id,
+                       Product.depth - ancestor.depth).
+                select_from(ancestor).join(Product, true()).
+                where(ancestor.id.in_(ancestor_ids),
+                      Product.path.startswith(
+                          product.path, autoescape=True))))
 
     @staticmethod
-    def __subtree_query(node_id: str):
-        #  TODO: like __from_this_to_root_query
-        top_query = db.session.query(Product). \
-            filter(Product.id == node_id). \
-            cte('cte', recursive=True)
+    def check_closure() -> None:
+        """
+        Rebuilds table 'product_closure' from parent_id by one statement if
+        it does not match table 'products' (e.g. it was not maintained with
+        another TREE_STRATEGY).
+        """
+        expected = db.session.query(
+            func.coalesce(func.sum(Product.depth + 1), 0),
+            func.coalesce(func.sum(
+                Product.depth * (Product.depth + 1) / 2), 0)).one()
+        actual = db.session.query(
+            func.count(ProductClosure.depth),
+            func.coalesce(func.sum(ProductClosure.depth), 0)).one()
+
+        if tuple(expected) == tuple(actual):
+            return
 
-        bot_query = db.session.query(Product). \
-            join(top_query, Product.parent_id == top_query.c.id)
+        top_query = select(
+            Product.id.label('ancestor_id'), Product.id.label('descendant_id'),
+            literal(0).label('depth')).cte('closure', recursive=True)
 
-        return db.session.query(Product). \
-            select_entity_from(top_query.union(bot_query))
+        bot_query = select(
+            top_query.c.ancestor_id, Product.id, top_query.c.depth + 1). \
+            join(top_query, Product.parent_id == top_query.c.descendant_id)
+
+        db.session.query(ProductClosure).delete(synchronize_session=False)
+        db.session.execute(ProductClosure.__table__.insert().from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(top_query.union_all(bot_query))))
+        db.session.commit()
+
+    @staticmethod
+    def load_deltas(node_ids) -> AncestorDeltas:
+        """ Loads nodes node_ids with all their ancestors for AncestorDeltas. """
+        node_ids = {node_id for node_id in node_ids if node_id is not None}
+        if len(node_ids) == 0:
+            return AncestorDeltas()
+        return AncestorDeltas(
+            ProductTree.__from_this_to_root_query(list(node_ids)))
 
     @staticmethod
-    def __update_from_this_to_root(node_id, new_date=None, price_delta=0,
-                                   count_delta=0) -> None:
+    def apply_deltas(deltas: AncestorDeltas, new_date=None) -> None:
         """
-        Updates all nodes in database whose contains the way from node to root.
+        Writes all accumulated deltas with one UPDATE statement.
 
-        :param node_id: str
-            product id in database
+        :param deltas: AncestorDeltas
         :param new_date: datetime.datetime or None
-            for all parents set update_date = new_date. If None then not update parents
-        :param price_delta:
-            for all parents set price = price + price_delta
-        :param count_delta:
-            for all parents set count = count + count_delta
-        :return: None
-        """
-        if not ProductTree.has_node(node_id):
+            for all changed nodes set update_date = new_date. If None then
+            not update dates
+        """
+        if len(deltas.deltas) == 0:
             return
 
-        nodes = ProductTree.__from_this_to_root_query(node_id). \
-            with_for_update().all()
+        price_whens = {node_id: d[0] for node_id, d in deltas.deltas.items()}
+        count_whens = {node_id: d[1] for node_id, d in deltas.deltas.items()}
 
-        update_dict = dict(
-            price=Product.price + price_delta,
-            count=Product.count + count_delta)
+        update_dict = {
+            Product.price: Product.price + case(
+                price_whens, value=Product.id, else_=0),
+            Product.count: Product.count + case(
+                count_whens, value=Product.id, else_=0)}
 
         if new_date is not None:
-            update_dict['update_date'] = new_date
+            update_dict[Product.update_date] = new_date
 
         db.session.query(Product). \
-            filter(Product.id.in_([el.id for el in nodes])). \
-            update(update_dict)
-        # db.session.commit()
+            filter(Product.id.in_(list(deltas.deltas))). \
+            update(update_dict, synchronize_session=False)
 
     @staticmethod
-    def __update_nodes(products: List[Product]) -> None:
+    def __update_nodes(products: List[Product], deltas: AncestorDeltas) -> None:
         """
-        Updates products in database table and updates all nodes whose contains the way
-        from node to root. If product not in table then raised database exception.
+        Checks updated products and collects changes of all nodes whose
+        contains the way from node to root. Old state of products is taken
+        from deltas. Products are written to the database by __upsert_nodes.
 
-        WARNING: If exception is raised then changes not be committed.
+        :return: list of moved products
         """
+        moved = []
         for product in products:
-            old_node = ProductTree.get_node(product.id)
-
-            if product.type_id != old_node.type_id:
+            if product.type_id != deltas.types[product.id]:
                 raise NodeTypeError(f'Can not change the node type')
 
-            """ Если поменялся родитель, то нужно перевесить вершину. """
-            if product.parent_id != old_node.parent_id:
+            old_parent_id = deltas.parents[product.id]
+            old_price, old_count = deltas.current(product.id)
 
-                ProductTree.__update_from_this_to_root(
-                    old_node.parent_id, product.update_date,
-                    -old_node.price, -old_node.count)
+            """ Если поменялся родитель, то нужно перевесить вершину. """
+            if product.parent_id != old_parent_id:
+                deltas.add(old_parent_id, -old_price, -old_count)
+                deltas.set_parent(product.id, product.parent_id)
+                moved.append(product)
 
                 if product.type_id == ProductType.get_id(ProductType.CATEGORY):
-                    ProductTree.__update_from_this_to_root(
-                        product.parent_id, product.update_date,
-                        old_node.price, old_node.count)
+                    deltas.add(product.parent_id, old_price, old_count)
                 else:
-                    ProductTree.__update_from_this_to_root(
-                        product.parent_id, product.update_date,
-                        product.price, 1)
+                    deltas.add(product.parent_id, product.price, 1)
             else:
                 if product.type_id == ProductType.get_id(ProductType.CATEGORY):
-                    ProductTree.__update_from_this_to_root(
-                        product.parent_id, product.update_date,
-                        0, 0)
+                    deltas.add(product.parent_id, 0, 0)
                 else:
-                    ProductTree.__update_from_this_to_root(
-                        product.parent_id, product.update_date,
-                        product.price - old_node.price, 0)
+                    deltas.add(product.parent_id, product.price - old_price, 0)
 
-            update_dict = product.update_dict()
-            if product.type_id == ProductType.get_id(ProductType.CATEGORY):
-                update_dict.pop('price')
+            if product.type_id == ProductType.get_id(ProductType.OFFER):
+                deltas.aggregates[product.id] = [product.price, old_count]
+                product.count = old_count
+            else:
+                product.count = 0
+                product.price = 0
 
-            update_dict['count'] = ProductTree.get_node(product.id).count
+        return moved
 
-            db.session.query(Product).filter(Product.id == product.id). \
-                update(update_dict)
-            # db.session.add(ProductTree.get_node(product.id).get_statistic())
-        db.session.commit()
+    @staticmethod
+    def __move_subtrees(moved: List[Product], deltas: AncestorDeltas) -> None:
+        """
+        Rewrites materialized paths of subtrees of moved categories, one
+        statement for each category. Deeper categories are moved first, so
+        their new paths are not matched by old paths of their ancestors.
+        """
+        category_id = ProductType.get_id(ProductType.CATEGORY)
+        moved = [p for p in moved if p.type_id == category_id]
+        moved.sort(key=lambda p: deltas.paths[p.id].count(
+            Product.PATH_SEPARATOR), reverse=True)
+
+        for product in moved:
+            old_path = deltas.paths[product.id]
+            new_path = product.path
+            depth_shift = new_path.count(Product.PATH_SEPARATOR) - \
+                old_path.count(Product.PATH_SEPARATOR)
+
+            db.session.query(Product). \
+                filter(Product.path.startswith(old_path, autoescape=True)). \
+                update({
+                    Product.path: literal(new_path) + func.substr(
+                        Product.path, len(old_path) + 1),
+                    Product.depth: Product.depth + depth_shift,
+                }, synchronize_session=False)
+
+    @staticmethod
+    def __upsert_statement(rows: List[dict]):
+        """
+        Returns INSERT ... ON CONFLICT DO UPDATE statement for rows or None
+        if database backend has not it. On conflict updates name, parent_id,
+        update_date and price of offers. Price and count of categories are
+        changed only by apply_deltas.
+        """
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            return None
+
+        stmt = insert(Product.__table__).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=[Product.id],
+            set_=dict(
+                name=stmt.excluded.name,
+                parent_id=stmt.excluded.parent_id,
+                update_date=stmt.excluded.update_date,
+                path=stmt.excluded.path,
+                depth=stmt.excluded.depth,
+                price=case(
+                    (stmt.excluded.type_id ==
+                     ProductType.get_id(ProductType.OFFER),
+                     stmt.excluded.price),
+                    else_=Product.__table__.c.price)))
+
+    @staticmethod
+    def __upsert_nodes(inserts: List[Product], updates: List[Product]) -> None:
+        """
+        Writes inserted and updated products with INSERT ... ON CONFLICT
+        DO UPDATE by chunks of UPSERT_CHUNK_SIZE rows. If backend has not
+        upsert then new rows are inserted and old rows are updated by
+        executemany.
+        """
+        rows = [dict(
+            id=p.id, name=p.name, parent_id=p.parent_id, type_id=p.type_id,
+            price=p.price, count=p.count, update_date=p.update_date,
+            path=p.path, depth=p.depth
+        ) for p in inserts + updates]
+
+        chunk = ProductTree.UPSERT_CHUNK_SIZE
+        if len(rows) == 0:
+            return
+
+        if ProductTree.__upsert_statement(rows[:1]) is not None:
+            for i in range(0, len(rows), chunk):
+                db.session.execute(
+                    ProductTree.__upsert_statement(rows[i:i + chunk]))
+            return
+
+        table = Product.__table__
+        if len(inserts) != 0:
+            db.session.execute(table.insert(), rows[:len(inserts)])
+        if len(updates) != 0:
+            offer_id = ProductType.get_id(ProductType.OFFER)
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('b_id')).values(
+                    name=bindparam('name'), parent_id=bindparam('parent_id'),
+                    update_date=bindparam('update_date'),
+                    path=bindparam('path'), depth=bindparam('depth'),
+                    price=case((table.c.type_id == offer_id,
+                                bindparam('price')), else_=table.c.price)),
+                [dict(b_id=row['id'], name=row['name'],
+                      parent_id=row['parent_id'], price=row['price'],
+                      update_date=row['update_date'], path=row['path'],
+                      depth=row['depth'])
+                 for row in rows[len(inserts):]])
 
     @staticmethod
     def remove_node(node_id) -> None:
@@ -438,31 +1685,273 @@ class ProductTree:
         Cascade delete product where product.id == node_id from 'products'.
         Deletes all descendants from 'products' and all entities from 'statistics'
         whose product_id depended on them.
+
+        Subtree is deleted by set-based statements over its materialized
+        path, rows are not loaded to the session.
         """
-        if not ProductTree.has_node(node_id):
+        nodes = ProductTree.__removed_nodes_query([node_id])
+        if len(nodes) == 0:
             raise NodeExistException(f'Database not contains node {node_id}')
 
-        node = ProductTree.get_node(node_id)
+        ProductTree.__remove_subtrees(nodes)
 
-        ProductTree.__update_from_this_to_root(
-            node.parent_id, price_delta=-node.price, count_delta=-node.count)
+    @staticmethod
+    def remove_nodes(node_ids: List[str]) -> dict:
+        """
+        Deletes subtrees of all node_ids in one transaction. Nodes lying
+        in subtree of another deleted node are deleted with it, and every
+        ancestor is changed once by the sum of deltas.
 
-        db.session.delete(ProductTree.get_node(node_id))
+        :return: dict node id -> True if it is deleted, False if database
+            does not contain it
+        """
+        node_ids = list(dict.fromkeys(node_ids))
+        nodes = ProductTree.__removed_nodes_query(node_ids)
+        found = {node.id for node in nodes}
+
+        nodes.sort(key=lambda node: len(node.path))
+        roots = []
+        for node in nodes:
+            if not any(node.path.startswith(root.path) for root in roots):
+                roots.append(node)
+
+        if len(roots) != 0:
+            ProductTree.__remove_subtrees(roots)
+
+        return {node_id: node_id in found for node_id in node_ids}
+
+    @staticmethod
+    def __removed_nodes_query(node_ids: List[str]):
+        """ Returns rows (id, parent_id, price, count, path) of node_ids. """
+        return db.session.query(
+            Product.id, Product.parent_id, Product.price, Product.count,
+            Product.path).filter(Product.id.in_(node_ids)).all()
+
+    @staticmethod
+    def __remove_subtrees(roots) -> None:
+        """
+        Deletes subtrees of roots (disjoint) with their statistics and
+        commits. Ancestor deltas are applied with one statement, every
+        table is cleaned by one DELETE over prefixes of paths.
+        """
+        deltas = ProductTree.load_deltas([root.parent_id for root in roots])
+        for root in roots:
+            deltas.add(root.parent_id, -root.price, -root.count)
+        ProductTree.apply_deltas(deltas)
+
+        in_subtrees = or_(*(
+            Product.path.startswith(root.path, autoescape=True)
+            for root in roots))
+        subtree = select(Product.id).where(in_subtrees)
+
+        removed_ids = [root.id for root in roots]
+        if response_cache.enabled or change_notifier.enabled or \
+                recent_changes.enabled:
+            removed_ids = list(db.session.execute(subtree).scalars())
+
+        db.session.query(Statistic). \
+            filter(Statistic.product_id.in_(subtree)). \
+            delete(synchronize_session=False)
+
+        db.session.query(OfferChange). \
+            filter(OfferChange.product_id.in_(subtree)). \
+            delete(synchronize_session=False)
+
+        for rollup in (HourlyStatistic, DailyStatistic):
+            db.session.query(rollup). \
+                filter(rollup.product_id.in_(subtree)). \
+                delete(synchronize_session=False)
+
+        if ProductTree.strategy() == ProductTree.CLOSURE:
+            db.session.query(ProductClosure). \
+                filter(ProductClosure.descendant_id.in_(subtree)). \
+                delete(synchronize_session=False)
+
+        db.session.query(Product).filter(in_subtrees). \
+            delete(synchronize_session=False)
+
+        removals = TreeVersion.add_removal()
+        change_notifier.publish(deltas.deltas, removed_ids)
+        db.session.commit()
+
+        ProductTree.apply_changes(deltas.deltas, removed_ids)
+
+        # Index includes this delete; if it also includes all previous
+        # ones, its snapshot stays valid (see warm_start_index).
+        with product_index.lock:
+            watermark = product_index.watermark
+            if product_index.loaded and watermark is not None and \
+                    watermark[1] == removals - 1:
+                product_index.watermark = (watermark[0], removals)
+
+    @staticmethod
+    def add_or_update_stream(import_stream: ShopUnitImportStream) -> None:
+        """
+        Inserts or updates products of import_stream chunk by chunk in one
+        transaction. Items whose parent is not in the database yet wait
+        for it in the following chunks. If updateDate follows the items,
+        chunks are written with PENDING_DATE which is replaced at the end.
+        Statistics of all changed nodes are written in the same transaction.
+        Ids of items are not collected again, they are kept by validator of
+        import_stream.
+        """
+        ancestor_ids = set()
+        pending = []
+        for chunk in import_stream.chunks():
+            pending.extend(chunk)
+            ready, pending = ProductTree.__split_ready(pending)
+            if len(ready) != 0:
+                ancestor_ids.update(ProductTree.__write_batch(
+                    ready, import_stream.update_date or
+                    ProductTree.PENDING_DATE))
+
+        if len(pending) != 0:
+            ancestor_ids.update(ProductTree.__write_batch(
+                pending, import_stream.update_date))
+
+        item_ids = import_stream.ids
+        changed_ids = list(item_ids) + \
+            [x for x in ancestor_ids if x not in item_ids]
+        chunk = ProductTree.UPSERT_CHUNK_SIZE
+        for i in range(0, len(changed_ids), chunk):
+            db.session.query(Product).filter(
+                Product.id.in_(changed_ids[i:i + chunk]),
+                Product.update_date == ProductTree.PENDING_DATE). \
+                update({Product.update_date: import_stream.update_date},
+                       synchronize_session=False)
+        db.session.query(OfferChange). \
+            filter(OfferChange.update_date == ProductTree.PENDING_DATE). \
+            update({OfferChange.update_date: import_stream.update_date},
+                   synchronize_session=False)
+
+        Product.write_statistics(changed_ids, import_stream.update_date)
+        change_notifier.publish(changed_ids)
         db.session.commit()
 
+        ProductTree.apply_changes(changed_ids)
+
+    @staticmethod
+    def __split_ready(products: List[Product]):
+        """
+        Splits products to those whose parents are in the database or
+        among ready products, and the rest.
+        """
+        parent_ids = {p.parent_id for p in products if p.parent_id is not None}
+        known = {row.id for row in db.session.query(Product.id).
+                 filter(Product.id.in_(list(parent_ids)))} \
+            if len(parent_ids) != 0 else set()
+
+        waiting = {p.id: p for p in products
+                   if p.parent_id is not None and p.parent_id not in known}
+        ready = [p for p in products if p.id not in waiting]
+        ready_ids = {p.id for p in ready}
+
+        changed = True
+        while changed:
+            changed = False
+            for p in list(waiting.values()):
+                if p.parent_id in ready_ids:
+                    del waiting[p.id]
+                    ready.append(p)
+                    ready_ids.add(p.id)
+                    changed = True
+
+        return ready, list(waiting.values())
+
     @staticmethod
-    def add_or_update_all(products: List[Product]) -> None:
+    def __write_batch(products: List[Product], update_date) -> set:
         """
-        Inserts or updates all products in the database, and also updates all the
-        ancestors of these nodes.
+        Writes products and changes of their ancestors without commit.
+        Returns ids of changed ancestors.
         """
+        for product in products:
+            product.update_date = update_date
+
+        deltas = ProductTree.load_deltas(
+            [p.id for p in products] + [p.parent_id for p in products])
+
+        category_id = ProductType.get_id(ProductType.CATEGORY)
+        types = dict(deltas.types)
+        types.update((p.id, p.type_id) for p in products)
+        for product in products:
+            if product.parent_id is None:
+                continue
+            if product.parent_id not in types:
+                raise ParentNotFoundException(
+                    f'Parent {product.parent_id} of {product.id} not found')
+            if types[product.parent_id] != category_id:
+                raise ValidationException('Parent must be a category')
+
         updates = []
         inserts = []
         for product in products:
-            if not ProductTree.has_node(product.id):
+            if product.id not in deltas.types:
                 inserts.append(product)
             else:
                 updates.append(product)
 
-        ProductTree.__add_nodes(inserts)
-        ProductTree.__update_nodes(updates)
+        ProductTree.__add_nodes(inserts, deltas)
+        moved = ProductTree.__update_nodes(updates, deltas)
+
+        for product in products:
+            product.path = deltas.path(product.id)
+            product.depth = product.path.count(Product.PATH_SEPARATOR) - 1
+
+        ProductTree.__move_subtrees(moved, deltas)
+        ProductTree.__upsert_nodes(inserts, updates)
+        OfferChange.write(products, update_date)
+
+        if ProductTree.strategy() == ProductTree.CLOSURE:
+            ProductTree.__insert_closure(inserts)
+            ProductTree.__move_closure(moved)
+
+        ProductTree.apply_deltas(deltas, update_date)
+        return set(deltas.deltas)
+
+    @staticmethod
+    def apply_changes(changed_ids, removed_ids=()) -> None:
+        """
+        Brings in-process replicas up to date after commit of changes:
+        nodes changed_ids are reloaded to product_index, subtrees of
+        removed_ids are removed from it, cached responses of all these
+        nodes are invalidated, and new offer changes are appended to
+        recent_changes. Called for changes of this process and for
+        changes of other processes (see sync.ChangeListener).
+        """
+        changed_ids = set(changed_ids)
+        removed_ids = set(removed_ids)
+        with product_index.lock:
+            for node_id in removed_ids:
+                product_index.remove(node_id)
+            ProductTree.__refresh_index(changed_ids)
+        response_cache.invalidate(itertools.chain(changed_ids, removed_ids))
+        if recent_changes.enabled:
+            recent_changes.remove(removed_ids)
+            OfferChange.refresh_recent(changed_ids)
+
+    @staticmethod
+    def reload_replicas() -> None:
+        """
+        Reloads product_index and recent_changes if they are used and
+        clears response_cache.
+        """
+        if product_index.loaded:
+            ProductTree.load_index()
+        if recent_changes.enabled:
+            OfferChange.load_recent()
+        response_cache.clear()
+
+    @staticmethod
+    def start_listener(app, mode: str, interval: float):
+        """
+        Starts sync.ChangeListener applying changes of other processes to
+        product_index and response_cache. Returns started listener.
+        """
+        if mode == ChangeListener.NOTIFY:
+            change_notifier.enabled = True
+        listener = ChangeListener(
+            app, mode, interval, ProductTree.apply_changes,
+            ProductTree.reload_replicas,
+            lambda: len(product_index.nodes) if product_index.loaded else None)
+        listener.start()
+        return listener
@@ -0,0 +1,111 @@
+import datetime
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class RecentChanges:
+    """
+    In-process ring buffer of rows of table 'offer_changes' of the last
+    WINDOW, split into buckets of BUCKET by update_date. Buckets older
+    than WINDOW before the latest change are dropped. Buffer does not
+    query the database, it is loaded and kept current by OfferChange.
+
+    Attributes:
+    -----------
+    enabled: bool
+        True if buffer is used by /sales
+    horizon: datetime.datetime
+        all changes since horizon are in the buffer, None if not loaded
+    ids: set
+        ids of rows in the buffer, rows are added once
+    """
+    WINDOW = datetime.timedelta(hours=24)
+
+    BUCKET = datetime.timedelta(hours=1)
+
+    EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self):
+        self.enabled = False
+        self.buckets: Dict[int, list] = dict()
+        self.horizon: Optional[datetime.datetime] = None
+        self.latest: Optional[datetime.datetime] = None
+        self.ids: Set[int] = set()
+        self.lock = threading.RLock()
+
+    def load(self, rows: Iterable, horizon: datetime.datetime) -> None:
+        """ Replaces content of buffer by rows of all changes since horizon. """
+        with self.lock:
+            self.buckets = dict()
+            self.latest = None
+            self.ids = set()
+            self.horizon = horizon
+            self.add(rows)
+
+    def add(self, rows: Iterable) -> None:
+        """ Appends rows not in the buffer yet and drops expired buckets. """
+        with self.lock:
+            for row in rows:
+                if row.id in self.ids:
+                    continue
+                self.buckets.setdefault(
+                    RecentChanges.__bucket(row.update_date), []).append(row)
+                self.ids.add(row.id)
+                if self.latest is None or row.update_date > self.latest:
+                    self.latest = row.update_date
+
+            if self.latest is None:
+                return
+            first = RecentChanges.__bucket(self.latest - RecentChanges.WINDOW)
+            for bucket in [x for x in self.buckets if x < first]:
+                self.ids.difference_update(
+                    row.id for row in self.buckets.pop(bucket))
+            self.horizon = max(
+                self.horizon, RecentChanges.EPOCH + first * RecentChanges.BUCKET)
+
+    def remove(self, product_ids: Iterable[str]) -> None:
+        """ Drops changes of removed products. """
+        product_ids = set(product_ids)
+        if len(product_ids) == 0:
+            return
+        with self.lock:
+            for bucket, rows in self.buckets.items():
+                self.ids.difference_update(
+                    row.id for row in rows if row.product_id in product_ids)
+                self.buckets[bucket] = [
+                    row for row in rows if row.product_id not in product_ids]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.buckets = dict()
+            self.horizon = None
+            self.latest = None
+            self.ids = set()
+
+    def covers(self, start_date: datetime.datetime) -> bool:
+        """ Returns True if buffer contains all changes since start_date. """
+        with self.lock:
+            return self.horizon is not None and start_date >= self.horizon
+
+    def get(self, start_date: datetime.datetime,
+            end_date: datetime.datetime) -> List:
+        """
+        Returns rows of changes in [start_date, end_date] ordered by
+        update_date. Only buckets of the period are read.
+        """
+        first = RecentChanges.__bucket(start_date)
+        last = RecentChanges.__bucket(end_date)
+        with self.lock:
+            buckets = [rows for bucket, rows in self.buckets.items()
+                       if first <= bucket <= last]
+        result = [row for rows in buckets for row in rows
+                  if start_date <= row.update_date <= end_date]
+        result.sort(key=lambda row: (row.update_date, row.id))
+        return result
+
+    @staticmethod
+    def __bucket(date: datetime.datetime) -> int:
+        return (date - RecentChanges.EPOCH) // RecentChanges.BUCKET
+
+
+recent_changes = RecentChanges()
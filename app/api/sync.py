@@ -0,0 +1,210 @@
+import datetime
+import json
+import logging
+import select
+import threading
+import uuid
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.database import db
+
+
+class ChangeNotifier:
+    """
+    Publishes ids of changed and removed products to other API processes
+    by PostgreSQL NOTIFY. Notifications are sent in the transaction of the
+    change, so they are delivered only after its commit.
+
+    Attributes:
+    -----------
+    channel: str
+        name of NOTIFY channel
+    enabled: bool
+        True if notifications are sent
+    sender: str
+        id of this process, own notifications are ignored by listener
+    """
+    # Payload of NOTIFY must be shorter than 8000 bytes.
+    MAX_PAYLOAD = 7999
+
+    # Larger changes are published as a request of full reload.
+    MAX_IDS = 3000
+
+    def __init__(self, channel: str = 'products_changes'):
+        self.channel = channel
+        self.enabled = False
+        self.sender = uuid.uuid4().hex
+
+    def publish(self, changed_ids: Iterable[str],
+                removed_ids: Iterable[str] = ()) -> None:
+        """
+        Sends changed_ids and removed_ids in the current transaction,
+        split into messages by size of their JSON in bytes.
+        """
+        if not self.enabled:
+            return
+
+        changed_ids = list(changed_ids)
+        removed_ids = list(removed_ids)
+        if len(changed_ids) + len(removed_ids) > ChangeNotifier.MAX_IDS:
+            self.__notify(dict(reload=True))
+            return
+        if len(changed_ids) + len(removed_ids) == 0:
+            return
+
+        empty_size = len(self.__payload(dict(changed=[], removed=[])))
+        message, size = dict(changed=[], removed=[]), empty_size
+        for key, ids in (('changed', changed_ids), ('removed', removed_ids)):
+            for node_id in ids:
+                # Id and separator ', ', payload is ASCII.
+                id_size = len(json.dumps(node_id)) + 2
+                if size + id_size > ChangeNotifier.MAX_PAYLOAD:
+                    self.__notify(message)
+                    message, size = dict(changed=[], removed=[]), empty_size
+                message[key].append(node_id)
+                size += id_size
+        self.__notify(message)
+
+    def parse(self, payload: str):
+        """
+        Returns message of payload or None if it was sent by this process.
+        """
+        message = json.loads(payload)
+        if message.get('sender') == self.sender:
+            return None
+        return message
+
+    def __notify(self, message: dict) -> None:
+        db.session.execute(
+            text('SELECT pg_notify(:channel, :payload)'),
+            dict(channel=self.channel, payload=self.__payload(message)))
+
+    def __payload(self, message: dict) -> str:
+        return json.dumps(dict(message, sender=self.sender))
+
+
+change_notifier = ChangeNotifier()
+
+
+class ChangeListener(threading.Thread):
+    """
+    Background thread applying changes made by other API processes to
+    in-process replicas.
+
+    In mode NOTIFY it listens the channel of change_notifier. In mode POLL
+    (backends without LISTEN/NOTIFY) it reads max(update_date) and count of
+    products every interval seconds: nodes with greater update_date are
+    applied as changed, and if count of products does not match, replicas
+    are reloaded (deletes do not change update_date).
+
+    :param apply_changes: function(changed_ids, removed_ids)
+    :param reload_all: function() reloading replicas from the database
+    :param count_nodes: function() returning size of replica or None if
+        size is unknown
+    """
+    NOTIFY = 'notify'
+    POLL = 'poll'
+
+    def __init__(self, app, mode: str, interval: float,
+                 apply_changes: Callable[[List[str], List[str]], None],
+                 reload_all: Callable[[], None],
+                 count_nodes: Callable[[], Optional[int]]):
+        super().__init__(name='products-change-listener', daemon=True)
+        self.app = app
+        self.mode = mode
+        self.interval = interval
+        self.apply_changes = apply_changes
+        self.reload_all = reload_all
+        self.count_nodes = count_nodes
+        self.stopped = threading.Event()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def run(self) -> None:
+        with self.app.app_context():
+            if self.mode == ChangeListener.NOTIFY:
+                self.__listen()
+            else:
+                self.__poll()
+
+    def __listen(self) -> None:
+        """
+        Listens the channel, reconnecting every interval seconds after the
+        connection is lost. Notifications sent while the listener was
+        disconnected are lost, so replicas are reloaded after reconnect.
+        """
+        resync = False
+        while not self.stopped.is_set():
+            try:
+                self.__listen_connection(resync)
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    'Listener of channel %s failed, reconnecting',
+                    change_notifier.channel)
+                self.stopped.wait(self.interval)
+            resync = True
+
+    def __listen_connection(self, resync: bool) -> None:
+        """ Listens the channel on a new connection until it is lost. """
+        connection = db.engine.raw_connection()
+        connection.detach()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{change_notifier.channel}"')
+            if resync:
+                self.__apply(dict(reload=True))
+
+            while not self.stopped.is_set():
+                ready, _, _ = select.select(
+                    [dbapi_connection], [], [], self.interval)
+                if len(ready) == 0:
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    message = change_notifier.parse(notify.payload)
+                    if message is not None:
+                        self.__apply(message)
+        finally:
+            connection.close()
+
+    def __apply(self, message: dict) -> None:
+        try:
+            if message.get('reload', False):
+                self.reload_all()
+            else:
+                self.apply_changes(message.get('changed', []),
+                                   message.get('removed', []))
+        finally:
+            db.session.remove()
+
+    def __poll(self) -> None:
+        from app.api.models import Product
+
+        last_date, last_count = self.__poll_state(Product)
+        while not self.stopped.wait(self.interval):
+            try:
+                date, count = self.__poll_state(Product)
+                if date is not None and (last_date is None or date > last_date):
+                    query = db.session.query(Product.id)
+                    if last_date is not None:
+                        query = query.filter(Product.update_date > last_date)
+                    self.apply_changes([row.id for row in query], [])
+
+                size = self.count_nodes()
+                if count != last_count and (size is None or size != count):
+                    self.reload_all()
+                last_date, last_count = date, count
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def __poll_state(product_model) -> Tuple[datetime.datetime, int]:
+        return tuple(db.session.query(
+            db.func.max(product_model.update_date),
+            db.func.count(product_model.id)).one())
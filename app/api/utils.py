@@ -1,27 +1,45 @@
 import datetime
+import functools
+import json
+import re
 import uuid
-from typing import List
+from types import MappingProxyType
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, List, \
+    Optional, Tuple
 
 
 class ProductType:
     CATEGORY = 'CATEGORY'
     OFFER = 'OFFER'
 
+    TYPES = (CATEGORY, OFFER)
+
+    # Frozen mapping type -> type id.
+    IDS = MappingProxyType({t: i + 1 for i, t in enumerate(TYPES)})
+
     @staticmethod
     def get_id(str_type: str) -> int:
-        return ProductType.get_types().index(str_type) + 1
+        return ProductType.IDS[str_type]
 
     @staticmethod
     def get_types() -> List[str]:
-        return [ProductType.CATEGORY, ProductType.OFFER]
+        return list(ProductType.TYPES)
 
     @staticmethod
     def get_type(id: int):
-        return ProductType.get_types()[id - 1]
+        return ProductType.TYPES[id - 1]
+
+
+UUID_RE = re.compile(
+    r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+    r'[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
 
 
 def is_cor_uuid(_uuid: str) -> bool:
     """ Checks the uuid string for correctness. """
+    # Canonical form is checked by regex, other forms by uuid.UUID.
+    if isinstance(_uuid, str) and UUID_RE.fullmatch(_uuid) is not None:
+        return True
     try:
         u = uuid.UUID(_uuid)
         return True
@@ -31,17 +49,205 @@ def is_cor_uuid(_uuid: str) -> bool:
         return False
 
 
+@functools.lru_cache(maxsize=4096)
 def date_to_iso(date: datetime.datetime) -> str:
-    """ Date to application ISO string format. """
+    """
+    Date to application ISO string format. Results are cached: nodes of
+    a subtree usually have only a few distinct dates.
+    """
     return date.isoformat(timespec='milliseconds') + 'Z'
 
 
+ISO_RE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}'
+                    r'\.[0-9]{3}Z')
+
+
 def parse_iso(date: str) -> datetime.datetime:
     """ Parse application ISO string format. """
+    # fromisoformat is much faster than strptime, but also accepts other
+    # ISO formats, so it is used only for strings of the exact format.
+    if isinstance(date, str) and ISO_RE.fullmatch(date) is not None:
+        try:
+            return datetime.datetime.fromisoformat(date[:23])
+        except ValueError:
+            pass
     return datetime.datetime.strptime(
         date, '%Y-%m-%dT%H:%M:%S.%fZ')
 
 
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def encode_cursor(date: datetime.datetime, row_id: int) -> str:
+    """
+    Returns cursor of keyset (update_date, id) of row: microseconds since
+    epoch and id separated by '-'. Clients must treat it as opaque.
+    """
+    return f'{(date - EPOCH) // datetime.timedelta(microseconds=1)}-{row_id}'
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """ Returns keyset (update_date, id) of cursor or raises ValidationException. """
+    try:
+        # Microseconds are negative for dates before 1970.
+        micro, row_id = cursor.rsplit('-', 1)
+        return EPOCH + datetime.timedelta(microseconds=int(micro)), int(row_id)
+    except (ValueError, OverflowError):
+        raise ValidationException
+
+
+def make_page(rows: Iterable, limit: Optional[int],
+              to_item: Callable[[Any], dict]) -> dict:
+    """
+    Returns {items, nextCursor} of rows ordered by keyset (update_date, id).
+    rows must contain limit + 1 rows if there are more rows after the page,
+    nextCursor is None for the last page.
+    """
+    items = []
+    last = None
+    for row in rows:
+        if limit is not None and len(items) == limit:
+            return dict(items=items, nextCursor=encode_cursor(
+                last.update_date, last.id))
+        items.append(to_item(row))
+        last = row
+    return dict(items=items, nextCursor=None)
+
+
+class JsonStreamReader:
+    """
+    Incremental reader of JSON object from binary stream. Values are
+    decoded one by one, so only the current value is held in memory.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    WHITESPACE = ' \t\n\r'
+
+    def __init__(self, stream: BinaryIO, chunk_size: int = CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.tail = b''
+
+    def object_items(self, array_keys=()) -> Iterator[Tuple[str, Any]]:
+        """
+        Yields (key, value) of the top level object. For keys in array_keys
+        value is an iterator of elements of the array, it must be consumed
+        before the next item. If stream is not valid JSON object then
+        raised ValidationException.
+        """
+        self.__expect('{')
+        if self.__peek() == '}':
+            self.pos += 1
+            self.__expect_end()
+            return
+
+        while True:
+            key = self.__value()
+            if not isinstance(key, str):
+                raise ValidationException('Object key must be string')
+            self.__expect(':')
+
+            if key in array_keys:
+                elements = self.__array()
+                yield key, elements
+                for _ in elements:
+                    pass
+            else:
+                yield key, self.__value()
+
+            if self.__next_char() == '}':
+                break
+            self.pos -= 1
+            self.__expect(',')
+        self.__expect_end()
+
+    def __array(self) -> Iterator[Any]:
+        self.__expect('[')
+        if self.__peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.__value()
+            if self.__next_char() == ']':
+                return
+            self.pos -= 1
+            self.__expect(',')
+
+    def __value(self) -> Any:
+        """
+        Decodes the next value. If it is not complete in buffer, or may
+        be continued in the stream (numbers), then more data is read.
+        """
+        self.__peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise ValidationException('Not valid JSON')
+            self.__read()
+
+    def __peek(self) -> str:
+        """ Skips whitespace and returns the next char. """
+        char = self.__next_char()
+        self.pos -= 1
+        return char
+
+    def __next_char(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and \
+                    self.buffer[self.pos] in JsonStreamReader.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                self.pos += 1
+                return self.buffer[self.pos - 1]
+            if self.eof:
+                raise ValidationException('Unexpected end of JSON')
+            self.__read()
+
+    def __expect(self, char: str) -> None:
+        if self.__next_char() != char:
+            raise ValidationException(f'Expected "{char}" in JSON')
+
+    def __expect_end(self) -> None:
+        while True:
+            if self.buffer[self.pos:].strip(JsonStreamReader.WHITESPACE):
+                raise ValidationException('Extra data after JSON')
+            if self.eof:
+                return
+            self.__read()
+
+    def __read(self) -> None:
+        """ Drops parsed part of buffer and appends next chunk of stream. """
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        data = self.tail + data
+        # Do not split multibyte utf-8 chars between chunks.
+        cut = len(data)
+        if not self.eof:
+            while cut > 0 and len(data) - cut < 3 and \
+                    (data[cut - 1] & 0xC0) == 0x80:
+                cut -= 1
+            if cut > 0 and data[cut - 1] >= 0xC0:
+                cut -= 1
+        self.tail = data[cut:]
+        try:
+            text = data[:cut].decode('utf-8')
+        except UnicodeDecodeError:
+            raise ValidationException('JSON is not utf-8')
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+
+
 class ValidationException(Exception):
     pass
 
@@ -0,0 +1,139 @@
+import sys
+from typing import List, Optional
+
+from app.api.utils import ProductType, is_cor_uuid, ValidationException
+
+
+class ShopUnitImport:
+    """
+    Class for validate imports data.
+
+    Attributes:
+    -----------
+    id: str (uuid)
+        primary key in table 'products'
+    name: str
+        offer/category name
+    parent_id: str
+        foreign key in table 'products
+    price: int
+    type_id: int
+        type id from utils.ProductTypes
+    """
+    __slots__ = ('id', 'name', 'parent_id', 'price', 'type_id')
+
+    def __init__(self, id: str, name: str, type: str,
+                 price: Optional[int] = None,
+                 parentId: Optional[str] = None):
+        """
+        Validate and set attributes for object. Validate parameters:
+            id -- must be uuid;
+            parentId -- must be uuid;
+            type -- must be in ['OFFER', 'CATEGORY'];
+            price -- must be None if type == 'CATEGORY' else must be int;
+            name -- must be not None.
+        If can not validate raised ValidationException.
+        """
+        if not is_cor_uuid(id):
+            raise ValidationException(f'Not correct uuid "{id}"')
+
+        if parentId is not None and not is_cor_uuid(parentId):
+            raise ValidationException('parentId must be None or uuid')
+
+        if name is None:
+            raise ValidationException(f'Name must be not None')
+
+        type_id = ProductType.IDS.get(type) if isinstance(type, str) else None
+        if type_id is None:
+            raise ValidationException(f'Type must be in {ProductType.get_types()}')
+
+        if type == ProductType.CATEGORY and price is not None:
+            raise ValidationException(f'CATEGORY must not has price')
+
+        if type == ProductType.OFFER and price is None:
+            raise ValidationException(f'OFFER must have price')
+
+        self.id = id
+        self.name = name
+        self.type_id = type_id
+        self.parent_id = parentId
+
+        try:
+            self.price = int(price) if price is not None else 0
+        except Exception:
+            raise ValidationException(f'Price must be "int"')
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in ShopUnitImport.__slots__}
+
+
+class ShopUnitImportValidator:
+    """
+    Class for validate items of one import in one pass. Besides checks of
+    ShopUnitImport, finds duplicate ids and cycles of parents within the
+    import (cycles through nodes stored in the database are found when
+    the import is applied). Messages of errors contain index of item.
+
+    Attributes:
+    -----------
+    parents: dict
+        id -> parentId of every validated item
+    """
+    def __init__(self):
+        self.parents = dict()
+
+    @staticmethod
+    def check_item(item, index: int) -> ShopUnitImport:
+        """
+        Validates item dict without checks depending on other items.
+        If can not validate raised ValidationException.
+        """
+        try:
+            if not isinstance(item, dict):
+                raise ValidationException('Item must be object')
+            try:
+                return ShopUnitImport(**item)
+            except TypeError:
+                raise ValidationException('Unexpected item fields')
+        except ValidationException as e:
+            raise ValidationException(f'Item {index}: {e}')
+
+    @staticmethod
+    def check_items(items: List, first_index: int) -> List[ShopUnitImport]:
+        """ check_item for items, may be called in another process. """
+        return [ShopUnitImportValidator.check_item(item, first_index + i)
+                for i, item in enumerate(items)]
+
+    def add(self, unit: ShopUnitImport) -> None:
+        """
+        Checks that unit does not repeat id and does not close a cycle of
+        parents with items added before.
+        """
+        if unit.id in self.parents:
+            raise ValidationException(
+                f'Item {len(self.parents)}: duplicate id "{unit.id}"')
+        # Children of one category share one string of its id, so ids
+        # of a large import are kept once.
+        if unit.parent_id is not None:
+            unit.parent_id = sys.intern(unit.parent_id)
+        self.parents[unit.id] = unit.parent_id
+
+        # Only the new edge may close a cycle, so it is enough to go up
+        # from its parent.
+        node_id = unit.parent_id
+        steps = 0
+        while node_id is not None and steps < len(self.parents):
+            if node_id == unit.id:
+                raise ValidationException(
+                    f'Item {len(self.parents) - 1}: parents cycle')
+            node_id = self.parents.get(node_id)
+            steps += 1
+
+    def validate(self, item) -> ShopUnitImport:
+        """ Validates item dict. If can not validate raised ValidationException. """
+        unit = ShopUnitImportValidator.check_item(item, len(self.parents))
+        self.add(unit)
+        return unit
+
+    def validate_all(self, items: List) -> List[ShopUnitImport]:
+        return [self.validate(item) for item in items]
@@ -0,0 +1,104 @@
+"""
+Compares peak RSS of reading and validating /imports payloads of
+different sizes: whole body as dict (as it was read before streaming) against
+incremental reading by chunks (ShopUnitImportStream), and peak RSS of the
+whole POST /imports with writing to the database. Every measure runs in a
+separate process; the import is written to a new SQLite file unless
+DATABASE_URL is set (its tables must be empty).
+
+Usage: python -m benchmarks.imports_memory [count ...]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import uuid
+
+
+def write_payload(file_path: str, count: int) -> None:
+    """ Writes import of one category and count - 1 offers in it. """
+    root_id = str(uuid.uuid4())
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write('{"items": [')
+        file.write(json.dumps(dict(
+            id=root_id, name='Category', type='CATEGORY', parentId=None)))
+        for i in range(count - 1):
+            file.write(', ' + json.dumps(dict(
+                id=str(uuid.uuid4()), name=f'Offer {i}', type='OFFER',
+                parentId=root_id, price=i), ensure_ascii=False))
+        file.write('], "updateDate": "2022-02-01T12:00:00.000Z"}')
+
+
+def post_import(file_path: str) -> int:
+    """ Sends file_path to POST /imports of a new app, returns items count. """
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+            os.path.dirname(file_path), 'imports_memory.db')
+    os.environ.setdefault('APP_SETTINGS', 'config.Config')
+    from app import create_app
+    from app.api.models import Product
+
+    app = create_app()
+    with app.test_client() as client, open(file_path, 'rb') as file:
+        response = client.post('/imports', input_stream=file,
+                               content_type='application/json')
+        assert response.status_code == 200, response.get_data(as_text=True)
+    with app.app_context():
+        count = Product.query.count()
+        db_file = app.config['SQLALCHEMY_DATABASE_URI']
+    if db_file.startswith('sqlite:///'):
+        os.remove(db_file[len('sqlite:///'):])
+    return count
+
+
+def run(mode: str, file_path: str) -> None:
+    from app.api.models import Product, ShopUnitImportStream
+    from app.api.utils import parse_iso
+    from app.api.validation import ShopUnitImportValidator
+
+    with open(file_path, 'rb') as file:
+        if mode == 'json':
+            data = json.load(file)
+            update_date = parse_iso(data['updateDate'])
+            units = ShopUnitImportValidator().validate_all(data['items'])
+            count = len([Product(update_date=update_date, **unit.to_dict())
+                         for unit in units])
+        elif mode == 'stream':
+            count = sum(len(chunk) for chunk in
+                        ShopUnitImportStream(file).chunks())
+        else:
+            count = post_import(file_path)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps(dict(count=count, peak_kb=peak)))
+
+
+def measure(mode: str, file_path: str) -> int:
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.imports_memory', '--run', mode,
+         file_path], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])['peak_kb']
+
+
+def main(counts) -> None:
+    print(f'{"items":>10} {"json, MB":>10} {"stream, MB":>10} '
+          f'{"/imports, MB":>13}')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for count in counts:
+            file_path = os.path.join(tmp_dir, f'import_{count}.json')
+            write_payload(file_path, count)
+            json_peak = measure('json', file_path)
+            stream_peak = measure('stream', file_path)
+            import_peak = measure('db', file_path)
+            print(f'{count:>10} {json_peak / 1024:>10.1f} '
+                  f'{stream_peak / 1024:>10.1f} {import_peak / 1024:>13.1f}')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], sys.argv[3])
+    else:
+        main([int(x) for x in sys.argv[1:]] or
+             [1_000, 10_000, 50_000, 100_000, 200_000])
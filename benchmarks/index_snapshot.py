@@ -0,0 +1,88 @@
+"""
+Compares cold start of ProductIndex with start from a snapshot file.
+
+Usage:
+    python -m benchmarks.index_snapshot [nodes]
+        synthetic tree, cold start is building from ready rows (the table
+        scan and transfer of rows are not counted);
+    python -m benchmarks.index_snapshot --db
+        table 'products' of DATABASE_URL, cold start is
+        ProductTree.load_index, warm start is ProductTree.warm_start_index.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import namedtuple
+
+from app.api.index import ProductIndex
+
+Row = namedtuple(
+    'Row', 'id name parent_id type_id price count update_date')
+
+
+def make_rows(size: int, fanout: int = 10):
+    """ Returns rows of tree with size nodes, categories have fanout children. """
+    dates = [datetime.datetime(2022, 2, 1) + datetime.timedelta(hours=i)
+             for i in range(24)]
+    rows = []
+    for i in range(size):
+        parent_id = rows[(i - 1) // fanout].id if i > 0 else None
+        is_category = i * fanout + 1 < size
+        rows.append(Row(
+            str(uuid.UUID(int=i + 1)), f'Product {i}', parent_id,
+            1 if is_category else 2, 0 if is_category else i, 0 if is_category else 1,
+            dates[i % len(dates)]))
+    return rows
+
+
+def measure(name: str, func):
+    start = time.perf_counter()
+    result = func()
+    print(f'{name:>16}: {time.perf_counter() - start:8.3f} s')
+    return result
+
+
+def main(size: int) -> None:
+    rows = make_rows(size)
+    print(f'nodes: {size}')
+
+    index = ProductIndex()
+    measure('cold load', lambda: index.load(rows))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'products.snapshot')
+        measure('snapshot save', lambda: index.save(file_path, (0, 0)))
+        print(f'{"snapshot size":>16}: {os.path.getsize(file_path) / 2 ** 20:8.1f} MB')
+
+        warm = ProductIndex()
+        measure('snapshot load', lambda: warm.load_snapshot(file_path))
+        assert warm.diff(rows) == []
+
+
+def main_db() -> None:
+    from app import create_app
+    from app.api.index import product_index
+    from app.api.models import ProductTree
+
+    with create_app().app_context():
+        measure('cold load', ProductTree.load_index)
+        print(f'nodes: {len(product_index.nodes)}')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'products.snapshot')
+            measure('snapshot save',
+                    lambda: ProductTree.save_index_snapshot(file_path))
+            product_index.clear()
+            measure('snapshot load',
+                    lambda: ProductTree.warm_start_index(file_path))
+            assert ProductTree.check_index(repair=False) == []
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--db']:
+        main_db()
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
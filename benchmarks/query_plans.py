@@ -0,0 +1,179 @@
+"""
+Records query plans of read endpoints. Seeds the database of
+DATABASE_URL (use a local database) with a category of offers with long
+history of statistics, unless it is already seeded, then requests every
+endpoint, captures its SELECT statements and writes their plans:
+EXPLAIN ANALYZE on PostgreSQL (without costs and timings, so output is
+stable), EXPLAIN QUERY PLAN on SQLite. Commit the output file, so
+changes of plans show up in review.
+
+Usage: python -m benchmarks.query_plans [offers] [output]
+    output is benchmarks/plans/<dialect>.txt by default.
+"""
+import datetime
+import os
+import random
+import sys
+import uuid
+
+from sqlalchemy import event, insert
+
+from app import create_app
+from app.api.models import DailyStatistic, HourlyStatistic, OfferChange, \
+    Product, Statistic
+from app.api.utils import ProductType
+from app.database import db
+
+ROOT_ID = str(uuid.UUID(int=1))
+
+CATEGORIES = 100
+
+# Changes of every offer, one a day before END.
+HISTORY = 30
+
+END = datetime.datetime(2022, 3, 1)
+
+CHUNK_SIZE = 10_000
+
+
+def make_id(i: int) -> str:
+    return str(uuid.UUID(int=i + 2))
+
+
+def seed(offers: int) -> None:
+    """ Inserts root category with CATEGORIES categories of offers. """
+    category_id = ProductType.get_id(ProductType.CATEGORY)
+    offer_id = ProductType.get_id(ProductType.OFFER)
+    root_path = Product.ids_to_path([ROOT_ID])
+    random.seed(0)
+
+    categories = [dict(
+        id=make_id(i), name=f'Category {i}', parent_id=ROOT_ID, price=0,
+        count=0, type_id=category_id, update_date=END,
+        path=root_path + make_id(i) + Product.PATH_SEPARATOR, depth=1)
+        for i in range(CATEGORIES)]
+    root = dict(id=ROOT_ID, name='Benchmark', parent_id=None, price=0,
+                count=0, type_id=category_id, update_date=END,
+                path=root_path, depth=0)
+
+    for start in range(0, offers, CHUNK_SIZE):
+        products = []
+        statistics = []
+        for i in range(start, min(start + CHUNK_SIZE, offers)):
+            category = categories[i % CATEGORIES]
+            node_id = make_id(CATEGORIES + i)
+            for day in range(HISTORY):
+                statistics.append(dict(
+                    product_id=node_id, name=f'Offer {i}', price=i + day,
+                    count=1, parent_id=category['id'], type_id=offer_id,
+                    update_date=END - datetime.timedelta(
+                        days=HISTORY - 1 - day,
+                        seconds=random.randrange(86_400))))
+            last = statistics[-1]
+            products.append(dict(
+                id=node_id, name=last['name'], parent_id=category['id'],
+                price=last['price'], count=1, type_id=offer_id,
+                update_date=last['update_date'],
+                path=category['path'] + node_id + Product.PATH_SEPARATOR,
+                depth=2))
+            category['price'] += last['price']
+            category['count'] += 1
+
+        db.session.execute(insert(Product), products)
+        db.session.execute(insert(Statistic), statistics)
+        db.session.execute(insert(OfferChange), [dict(
+            product_id=row['product_id'], update_date=row['update_date'],
+            name=row['name'], parent_id=row['parent_id'], price=row['price'])
+            for row in statistics])
+
+    root['price'] = sum(category['price'] for category in categories)
+    root['count'] = sum(category['count'] for category in categories)
+    db.session.execute(insert(Product), [root] + categories)
+    db.session.commit()
+    HourlyStatistic.backfill()
+    DailyStatistic.backfill()
+
+
+def endpoint_requests(offers: int) -> list:
+    """ Returns (title, url, headers) of requests of read endpoints. """
+    offer = make_id(CATEGORIES + offers // 2)
+    date = '2022-02-20T12:00:00.000Z'
+    period = 'dateStart=2022-02-10T00:00:00.000Z&' \
+             'dateEnd=2022-02-20T00:00:00.000Z'
+    return [
+        ('/nodes/<id> of category', f'/nodes/{make_id(0)}', {}),
+        ('/nodes/<id> page', f'/nodes/{ROOT_ID}?depth=1&limit=10', {}),
+        ('/nodes of offers', f'/nodes?ids={offer},{make_id(1)}', {}),
+        ('/sales', f'/sales?date={date}', {}),
+        ('/sales page', f'/sales?date={date}&limit=100', {}),
+        ('/node/<id>/statistic', f'/node/{offer}/statistic', {}),
+        ('/node/<id>/statistic of period',
+         f'/node/{offer}/statistic?{period}', {}),
+        ('/node/<id>/statistic page',
+         f'/node/{offer}/statistic?{period}&limit=5', {}),
+        ('/node/<id>/statistic NDJSON', f'/node/{offer}/statistic?{period}',
+         {'Accept': 'application/x-ndjson'}),
+        ('/node/<id>/statistic hourly',
+         f'/node/{offer}/statistic?{period}&resolution=hour', {}),
+        ('/node/<id>/statistic daily',
+         f'/node/{offer}/statistic?{period}&resolution=day', {}),
+    ]
+
+
+def explain(statement: str, parameters) -> list:
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        rows = connection.exec_driver_sql(
+            'EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF, SUMMARY OFF) ' +
+            statement, parameters)
+        return [row[0] for row in rows]
+    rows = connection.exec_driver_sql(
+        'EXPLAIN QUERY PLAN ' + statement, parameters)
+    return [row[-1] for row in rows]
+
+
+def main(offers: int, output) -> None:
+    app = create_app()
+    with app.app_context():
+        if db.session.get(Product, ROOT_ID) is None:
+            print(f'seeding {offers} offers...')
+            seed(offers)
+            db.session.execute(db.text('ANALYZE'))
+            db.session.commit()
+        dialect = db.engine.dialect.name
+
+        captured = []
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def capture(conn, cursor, statement, parameters, context, many):
+            if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+                captured.append((statement, parameters))
+
+        lines = []
+        client = app.test_client()
+        for title, url, headers in endpoint_requests(offers):
+            captured.clear()
+            response = client.get(url, headers=headers)
+            response.get_data()
+            assert response.status_code == 200, (url, response.status_code)
+
+            lines.append(f'### {title}: GET {url}')
+            for statement, parameters in list(captured):
+                lines.append(' '.join(statement.split()))
+                lines.extend('    ' + line
+                             for line in explain(statement, parameters))
+            lines.append('')
+
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+    output = output or os.path.join(
+        os.path.dirname(__file__), 'plans', f'{dialect}.txt')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        file.write('\n'.join(lines))
+    print(f'plans are written to {output}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+         sys.argv[2] if len(sys.argv) > 2 else None)
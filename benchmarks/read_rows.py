@@ -0,0 +1,83 @@
+"""
+Compares reading statistics rows as ORM entities and as rows of columns,
+which are used by Statistic.get. Writes a new offer with rows of
+statistics to the database of DATABASE_URL and deletes it, other rows
+are not touched.
+
+Usage: python -m benchmarks.read_rows [rows]
+"""
+import datetime
+import io
+import json
+import sys
+import time
+import tracemalloc
+import uuid
+
+from sqlalchemy import insert
+
+from app import create_app
+from app.api.models import ProductTree, ShopUnitImportStream, Statistic
+from app.api.utils import ProductType, date_to_iso
+from app.database import db
+
+
+def import_items(items: list, date: datetime.datetime) -> None:
+    """ Applies import of items like POST /imports. """
+    body = json.dumps(dict(items=items, updateDate=date_to_iso(date)))
+    ProductTree.add_or_update_stream(
+        ShopUnitImportStream(io.BytesIO(body.encode())))
+
+
+def seed(rows: int) -> str:
+    """ Imports offer with rows of statistics. """
+    date = datetime.datetime.utcnow().replace(microsecond=0)
+    product_id = str(uuid.uuid4())
+    type_id = ProductType.get_id(ProductType.OFFER)
+    import_items([dict(id=product_id, name='Benchmark', parentId=None,
+                       price=1, type=ProductType.OFFER)], date)
+
+    step = 10_000
+    # The import writes the first row.
+    for start in range(1, rows, step):
+        db.session.execute(insert(Statistic), [dict(
+            product_id=product_id, name='Benchmark', parent_id=None,
+            price=i, count=1, type_id=type_id,
+            update_date=date - datetime.timedelta(seconds=i))
+            for i in range(start, min(start + step, rows))])
+    db.session.commit()
+    return product_id
+
+
+def measure(title: str, read, rows: int) -> None:
+    db.session.expunge_all()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = read()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(result) == rows
+    print(f'{title}: {seconds:.2f} s, {seconds / rows * 1e6:.2f} us/row, '
+          f'peak memory: {peak / 2 ** 20:.1f} MB')
+
+
+def main(rows: int) -> None:
+    with create_app().app_context():
+        product_id = seed(rows)
+        try:
+            measure('ORM entities', lambda: db.session.query(Statistic).filter(
+                Statistic.product_id == product_id).all(), rows)
+            measure('rows of columns', lambda: db.session.execute(db.select(
+                Statistic.product_id, Statistic.name, Statistic.update_date,
+                Statistic.parent_id, Statistic.price, Statistic.count,
+                Statistic.type_id
+            ).where(Statistic.product_id == product_id)).all(), rows)
+            measure('Statistic.get', lambda: Statistic.get(
+                product_id)['items'], rows)
+        finally:
+            ProductTree.remove_node(product_id)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
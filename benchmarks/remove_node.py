@@ -0,0 +1,67 @@
+"""
+Measures ProductTree.remove_node of a category with many descendants
+and statistics rows. Writes a new random subtree to the database of
+DATABASE_URL and deletes it, other rows are not touched.
+
+Usage: python -m benchmarks.remove_node [descendants]
+"""
+import datetime
+import io
+import json
+import resource
+import sys
+import time
+import uuid
+
+from app import create_app
+from app.api.models import ProductTree, ShopUnitImportStream
+from app.api.utils import ProductType, date_to_iso
+
+CATEGORIES = 100
+
+
+def import_items(items: list, date: datetime.datetime) -> None:
+    """ Applies import of items like POST /imports. """
+    body = json.dumps(dict(items=items, updateDate=date_to_iso(date)))
+    ProductTree.add_or_update_stream(
+        ShopUnitImportStream(io.BytesIO(body.encode())))
+
+
+def seed(descendants: int) -> str:
+    """ Imports root category with CATEGORIES subcategories of offers. """
+    date = datetime.datetime.utcnow().replace(microsecond=0)
+    root_id = str(uuid.uuid4())
+    items = [dict(id=root_id, name='Benchmark', parentId=None,
+                  type=ProductType.CATEGORY)]
+    category_ids = [str(uuid.uuid4()) for _ in range(CATEGORIES)]
+    items.extend(dict(id=category_id, name='Category', parentId=root_id,
+                      type=ProductType.CATEGORY)
+                 for category_id in category_ids)
+    items.extend(dict(id=str(uuid.uuid4()), name=f'Offer {i}', price=i,
+                      parentId=category_ids[i % CATEGORIES],
+                      type=ProductType.OFFER)
+                 for i in range(descendants - CATEGORIES))
+
+    import_items(items, date)
+    return root_id
+
+
+def main(descendants: int) -> None:
+    with create_app().app_context():
+        start = time.perf_counter()
+        root_id = seed(descendants)
+        print(f'seed {descendants} descendants: '
+              f'{time.perf_counter() - start:.2f} s')
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        ProductTree.remove_node(root_id)
+        seconds = time.perf_counter() - start
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        print(f'remove_node: {seconds:.2f} s, '
+              f'peak RSS growth: {(rss_after - rss_before) / 1024:.1f} MB')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
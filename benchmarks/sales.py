@@ -0,0 +1,110 @@
+"""
+Measures /sales: the former scan of 'products' by update_date and type,
+table 'offer_changes' read by index on update_date, and in-process
+recent_changes. Writes a new category with offers changed during DAYS
+days to the database of DATABASE_URL and deletes it, other rows are not
+touched.
+
+Usage: python -m benchmarks.sales [products]
+"""
+import datetime
+import io
+import json
+import sys
+import time
+import uuid
+
+from sqlalchemy import insert
+
+from app import create_app
+from app.api.models import OfferChange, Product, ProductTree, \
+    ShopUnitImportStream
+from app.api.recent import recent_changes
+from app.api.utils import ProductType, date_to_iso
+from app.database import db
+
+DAYS = 30
+
+CHUNK_SIZE = 10_000
+
+
+def import_items(items: list, date: datetime.datetime) -> None:
+    """ Applies import of items like POST /imports. """
+    body = json.dumps(dict(items=items, updateDate=date_to_iso(date)))
+    ProductTree.add_or_update_stream(
+        ShopUnitImportStream(io.BytesIO(body.encode())))
+
+
+def seed(products: int, end: datetime.datetime) -> str:
+    """
+    Inserts category with products offers, every offer is changed once
+    at a random moment of DAYS days before end.
+    """
+    root_id = str(uuid.uuid4())
+    root_path = Product.ids_to_path([root_id])
+    import_items([dict(id=root_id, name='Benchmark', parentId=None,
+                       type=ProductType.CATEGORY)], end)
+
+    step = datetime.timedelta(days=DAYS) / products
+    offer_id = ProductType.get_id(ProductType.OFFER)
+    for start in range(0, products, CHUNK_SIZE):
+        rows = [dict(id=str(uuid.uuid4()), name=f'Offer {i}', price=i,
+                     count=1, parent_id=root_id, type_id=offer_id,
+                     update_date=end - step * i)
+                for i in range(start, min(start + CHUNK_SIZE, products))]
+        for row in rows:
+            row['path'] = root_path + row['id'] + Product.PATH_SEPARATOR
+            row['depth'] = 1
+        db.session.execute(insert(Product), rows)
+        db.session.execute(insert(OfferChange), [dict(
+            product_id=row['id'], update_date=row['update_date'],
+            name=row['name'], parent_id=root_id, price=row['price'])
+            for row in rows])
+        db.session.commit()
+    return root_id
+
+
+def scan_products(start_date, end_date) -> list:
+    """ Former Product.get_from_period. """
+    return db.session.query(Product).filter(
+        Product.update_date >= start_date,
+        Product.update_date <= end_date,
+        Product.type_id == ProductType.get_id(ProductType.OFFER)).all()
+
+
+def measure(title: str, function) -> None:
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    print(f'{title}: {seconds * 1000:.0f} ms, {len(result)} offers')
+
+
+def main(products: int) -> None:
+    with create_app().app_context():
+        end = datetime.datetime.utcnow().replace(microsecond=0)
+        start = time.perf_counter()
+        root_id = seed(products, end)
+        print(f'seed {products} products: '
+              f'{time.perf_counter() - start:.0f} s')
+
+        try:
+            day_before = end - datetime.timedelta(days=1)
+            measure('scan of products',
+                    lambda: scan_products(day_before, end))
+
+            recent_changes.enabled = False
+            measure('offer_changes by index',
+                    lambda: list(OfferChange.query_latest(day_before, end)))
+
+            recent_changes.enabled = True
+            OfferChange.load_recent()
+            measure('recent_changes',
+                    lambda: list(OfferChange.query_latest(day_before, end)))
+        finally:
+            recent_changes.enabled = False
+            recent_changes.clear()
+            ProductTree.remove_node(root_id)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000)
@@ -0,0 +1,113 @@
+"""
+Measures serialization of /nodes/<id> and /node/<id>/statistic payloads:
+building and encoding them by jsonify with uncached date_to_iso and by
+backends of JsonEncoder, then encode time and size of every format and
+compression of ResponseEncoder. Database is not used, payloads are built
+from random records.
+
+Usage: python -m benchmarks.serialization [nodes]
+"""
+import datetime
+import random
+import sys
+import time
+import uuid
+
+from flask import Flask, jsonify
+
+from app.api import utils
+from app.api.encoder import JsonEncoder, ResponseEncoder, orjson
+from app.api.index import NodeRecord
+from app.api.models import ProductTree
+from app.api.utils import ProductType
+
+CATEGORIES = 100
+
+DATES = 5
+
+
+def records(nodes: int) -> list:
+    """ Returns records of category tree with a few distinct dates. """
+    start = datetime.datetime(2022, 2, 1)
+    dates = [start + datetime.timedelta(hours=i) for i in range(DATES)]
+    root = NodeRecord(str(uuid.uuid4()), 'Root', None,
+                      ProductType.get_id(ProductType.CATEGORY), 0, 0, start)
+    result = [root]
+    categories = [NodeRecord(
+        str(uuid.uuid4()), f'Категория {i}', root.id,
+        ProductType.get_id(ProductType.CATEGORY), 0, 0, random.choice(dates))
+        for i in range(CATEGORIES)]
+    result.extend(categories)
+    result.extend(NodeRecord(
+        str(uuid.uuid4()), f'Товар {i}', categories[i % CATEGORIES].id,
+        ProductType.get_id(ProductType.OFFER), i, 1, random.choice(dates))
+        for i in range(nodes - CATEGORIES - 1))
+    return result
+
+
+def subtree(nodes: list, date=None) -> dict:
+    """
+    Builds payload of /nodes/<id> like ProductTree.get_subtree, dates
+    are formatted by date if it is given.
+    """
+    dicts = {node.id: ProductTree.node_to_dict(node) for node in nodes}
+    if date is not None:
+        for node in nodes:
+            dicts[node.id]['date'] = date(node.update_date)
+    for node in nodes[1:]:
+        dicts[node.parent_id]['children'].append(dicts[node.id])
+    return dicts[nodes[0].id]
+
+
+def statistic(nodes: list, date=None) -> dict:
+    """ Builds payload of /node/<id>/statistic like Statistic.get. """
+    return {'items': [dict(
+        id=node.id, name=node.name,
+        date=node.update_date if date is None else date(node.update_date),
+        parentId=node.parent_id, price=node.price,
+        type=ProductType.get_type(node.type_id)) for node in nodes]}
+
+
+def measure(title: str, function):
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    print(f'  {title}: {seconds * 1000:.0f} ms')
+    return result
+
+
+def main(nodes: int) -> None:
+    data = records(nodes)
+    uncached = utils.date_to_iso.__wrapped__
+
+    for name, build in (('/nodes/<id>', subtree),
+                        ('/node/<id>/statistic', statistic)):
+        print(f'{name}, {nodes} nodes')
+        with Flask(__name__).app_context():
+            measure('build and jsonify, uncached date_to_iso',
+                    lambda: jsonify(build(data, uncached)).get_data())
+
+        encoder = JsonEncoder()
+        measure('build and encode by JsonEncoder json',
+                lambda: encoder.dumps(build(data)))
+        if orjson is not None:
+            encoder.configure(JsonEncoder.ORJSON)
+            measure('build and encode by JsonEncoder orjson',
+                    lambda: encoder.dumps(build(data)))
+
+        print('  formats of ResponseEncoder (encode only):')
+        payload = build(data)
+        response_encoder = ResponseEncoder(JsonEncoder())
+        media_types = [media_type for media_type in
+                       response_encoder.media_types()
+                       if media_type not in ResponseEncoder.ALIASES]
+        for media_type in media_types:
+            for encoding in [None] + response_encoder.encodings():
+                body = measure(f'{media_type} {encoding or ""}'.rstrip(),
+                               lambda: response_encoder.encode(
+                                   payload, media_type, encoding))
+                print(f'    size: {len(body) / 1024:.0f} KB')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,74 @@
+"""
+Measures items validated per second: validation of import items one by
+one as it was done before ShopUnitImportValidator (copied below) against
+ShopUnitImportValidator.
+
+Usage: python -m benchmarks.validation [count]
+"""
+import sys
+import time
+import uuid
+
+from app.api.validation import ShopUnitImportValidator
+from app.api.utils import ValidationException
+
+
+def old_is_cor_uuid(_uuid: str) -> bool:
+    try:
+        uuid.UUID(_uuid)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def old_get_types():
+    return ['CATEGORY', 'OFFER']
+
+
+class OldShopUnitImport:
+    def __init__(self, id, name, type, price=None, parentId=None):
+        if not old_is_cor_uuid(id):
+            raise ValidationException
+        if parentId is not None and not old_is_cor_uuid(parentId):
+            raise ValidationException
+        if name is None:
+            raise ValidationException
+        if type not in old_get_types():
+            raise ValidationException
+        if type == 'CATEGORY' and price is not None:
+            raise ValidationException
+        if type == 'OFFER' and price is None:
+            raise ValidationException
+        self.id = id
+        self.name = name
+        self.type_id = old_get_types().index(type) + 1
+        self.parent_id = parentId
+        self.price = int(price) if price is not None else 0
+
+
+def make_items(count: int):
+    root_id = str(uuid.uuid4())
+    items = [dict(id=root_id, name='Category', type='CATEGORY', parentId=None)]
+    items.extend(dict(id=str(uuid.uuid4()), name=f'Offer {i}', type='OFFER',
+                      parentId=root_id, price=i) for i in range(count - 1))
+    return items
+
+
+def measure(name: str, func, count: int) -> None:
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    print(f'{name:>10}: {count / seconds:>12,.0f} items/s')
+
+
+def main(count: int) -> None:
+    items = make_items(count)
+    print(f'items: {count}')
+    measure('before', lambda: [OldShopUnitImport(**item) for item in items],
+            count)
+    measure('after', lambda: ShopUnitImportValidator().validate_all(items),
+            count)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
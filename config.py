@@ -4,3 +4,34 @@ import os
 class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Tree queries strategy: 'path', 'cte' or 'closure'.
+    TREE_STRATEGY = os.environ.get('TREE_STRATEGY', 'path')
+    # Keep products tree in the process memory for reads of subtrees.
+    TREE_INDEX = os.environ.get('TREE_INDEX', '0') == '1'
+    # Snapshot file of products tree for fast start, used with TREE_INDEX.
+    TREE_SNAPSHOT = os.environ.get('TREE_SNAPSHOT', None)
+    # Compare the index started from snapshot with the table, it is loaded
+    # again if they differ.
+    TREE_SNAPSHOT_CHECK = os.environ.get('TREE_SNAPSHOT_CHECK', '1') == '1'
+    # Encoder of JSON responses: 'json' or 'orjson' (optional package).
+    JSON_ENCODER = os.environ.get('JSON_ENCODER', 'json')
+    # Compress responses of read endpoints if client accepts gzip/zstd.
+    RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', '1') == '1'
+    # Size limit of cache of /nodes responses in bytes, 0 disables cache.
+    NODES_CACHE_BYTES = int(os.environ.get('NODES_CACHE_BYTES', 0))
+    # Keep offer changes of the last 24 hours in the process memory for
+    # /sales.
+    SALES_BUFFER = os.environ.get('SALES_BUFFER', '0') == '1'
+    # Sync of in-process replicas between API processes: 'off', 'notify'
+    # (PostgreSQL LISTEN/NOTIFY) or 'poll' (max(update_date) every
+    # TREE_SYNC_INTERVAL seconds). Polling runs only if the process has
+    # replicas (TREE_INDEX, NODES_CACHE_BYTES or SALES_BUFFER).
+    TREE_SYNC = os.environ.get('TREE_SYNC', 'poll')
+    TREE_SYNC_INTERVAL = float(os.environ.get('TREE_SYNC_INTERVAL', 1))
+    # Apply imports asynchronously, /imports returns id of the job.
+    IMPORTS_ASYNC = os.environ.get('IMPORTS_ASYNC', '0') == '1'
+    # Processes checking items of large imports, 0 disables them; items
+    # after the first IMPORTS_PARALLEL_THRESHOLD are sent to processes.
+    IMPORTS_PROCESSES = int(os.environ.get('IMPORTS_PROCESSES', 0))
+    IMPORTS_PARALLEL_THRESHOLD = int(
+        os.environ.get('IMPORTS_PARALLEL_THRESHOLD', 50_000))
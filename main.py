@@ -1,7 +1,5 @@
 from waitress import serve
 from app import create_app
 
-app = create_app()
-
 if __name__ == '__main__':
-    serve(app, host='0.0.0.0', port='80')
+    serve(create_app(), host='0.0.0.0', port='80')
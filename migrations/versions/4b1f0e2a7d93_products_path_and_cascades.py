@@ -0,0 +1,112 @@
+"""products path and cascades
+
+Materialized path and depth of table 'products' with the prefix index on
+path, filled for existing rows by a recursive query over parent_id, and
+ON DELETE CASCADE of foreign keys of products.parent_id and
+statistics.product_id. Tables are created by db.create_all() in
+create_app, which already has all of it in new databases, so only
+missing parts are added.
+
+Revision ID: 4b1f0e2a7d93
+Revises: c0ee30fbb9cd
+Create Date: 2026-10-18 16:05:41.503218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1f0e2a7d93'
+down_revision = 'c0ee30fbb9cd'
+branch_labels = None
+depends_on = None
+
+
+PATH_SEPARATOR = '.'
+
+# Names of foreign keys created without name (SQLite) in batch mode.
+NAMING_CONVENTION = {
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+FOREIGN_KEYS = [('products', 'parent_id'), ('statistics', 'product_id')]
+
+
+def existing_columns():
+    return {column['name'] for column in
+            sa.inspect(op.get_bind()).get_columns('products')}
+
+
+def existing_indexes():
+    return {index['name'] for index in
+            sa.inspect(op.get_bind()).get_indexes('products')}
+
+
+def fill_paths():
+    """ Fills path and depth of all rows from roots down by parent_id. """
+    op.execute(sa.text(
+        'WITH RECURSIVE tree(id, path, depth) AS ('
+        ' SELECT id, id || :separator, 0 FROM products'
+        ' WHERE parent_id IS NULL'
+        ' UNION ALL'
+        ' SELECT products.id, tree.path || products.id || :separator,'
+        ' tree.depth + 1 FROM products JOIN tree'
+        ' ON products.parent_id = tree.id) '
+        'UPDATE products SET path = tree.path, depth = tree.depth '
+        'FROM tree WHERE products.id = tree.id'
+    ).bindparams(separator=PATH_SEPARATOR))
+
+
+def set_ondelete(table: str, column: str, ondelete):
+    """ Recreates foreign key of column to products.id with ondelete. """
+    foreign_key = next(
+        (fk for fk in sa.inspect(op.get_bind()).get_foreign_keys(table)
+         if fk['constrained_columns'] == [column]), None)
+    current = None if foreign_key is None else \
+        foreign_key.get('options', {}).get('ondelete')
+    if foreign_key is not None and \
+            (current or '').upper() == (ondelete or '').upper():
+        return
+
+    name = NAMING_CONVENTION['fk'] % dict(
+        table_name=table, column_0_name=column,
+        referred_table_name='products')
+    if foreign_key is not None and foreign_key['name']:
+        name = foreign_key['name']
+    with op.batch_alter_table(
+            table, naming_convention=NAMING_CONVENTION) as batch:
+        if foreign_key is not None:
+            batch.drop_constraint(name, type_='foreignkey')
+        batch.create_foreign_key(name, 'products', [column], ['id'],
+                                 ondelete=ondelete)
+
+
+def upgrade():
+    if 'path' not in existing_columns():
+        op.add_column('products', sa.Column('path', sa.String(), nullable=True))
+        op.add_column('products', sa.Column('depth', sa.Integer(), nullable=True))
+        fill_paths()
+        with op.batch_alter_table('products') as batch:
+            batch.alter_column('path', existing_type=sa.String(),
+                               nullable=False)
+            batch.alter_column('depth', existing_type=sa.Integer(),
+                               nullable=False)
+
+    if 'ix_products_path' not in existing_indexes():
+        op.create_index('ix_products_path', 'products', ['path'],
+                        postgresql_ops={'path': 'varchar_pattern_ops'})
+
+    for table, column in FOREIGN_KEYS:
+        set_ondelete(table, column, 'CASCADE')
+
+
+def downgrade():
+    for table, column in FOREIGN_KEYS:
+        set_ondelete(table, column, None)
+
+    if 'ix_products_path' in existing_indexes():
+        op.drop_index('ix_products_path', table_name='products')
+    if 'path' in existing_columns():
+        with op.batch_alter_table('products') as batch:
+            batch.drop_column('depth')
+            batch.drop_column('path')
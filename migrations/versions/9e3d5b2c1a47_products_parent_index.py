@@ -0,0 +1,43 @@
+"""products parent index
+
+Index of table 'products' on (parent_id, id) for pages of children of
+/nodes/<id>, which are read level by level for returned categories.
+Only a missing index is created, on PostgreSQL it is built concurrently,
+without locking writes.
+
+Revision ID: 9e3d5b2c1a47
+Revises: 4b1f0e2a7d93
+Create Date: 2026-10-18 17:12:09.318840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3d5b2c1a47'
+down_revision = '4b1f0e2a7d93'
+branch_labels = None
+depends_on = None
+
+
+INDEX = 'ix_products_parent_id_id'
+
+
+def existing_indexes():
+    return {index['name'] for index in
+            sa.inspect(op.get_bind()).get_indexes('products')}
+
+
+def upgrade():
+    if INDEX in existing_indexes():
+        return
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index(INDEX, 'products', ['parent_id', 'id'],
+                        postgresql_concurrently=concurrently)
+
+
+def downgrade():
+    if INDEX in existing_indexes():
+        op.drop_index(INDEX, table_name='products')
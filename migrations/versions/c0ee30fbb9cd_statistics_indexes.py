@@ -0,0 +1,48 @@
+"""statistics indexes
+
+Indexes of table 'statistics' for /node/<id>/statistic (product_id and
+range of update_date) and for queries by range of update_date. Tables
+are created by db.create_all() in create_app, which also creates these
+indexes in new databases, so only missing indexes are created. On
+PostgreSQL they are built concurrently, without locking writes.
+
+Revision ID: c0ee30fbb9cd
+Revises: 
+Create Date: 2026-10-18 11:22:18.227732
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c0ee30fbb9cd'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = {
+    'ix_statistics_product_id_update_date': ['product_id', 'update_date'],
+    'ix_statistics_update_date': ['update_date'],
+}
+
+
+def existing_indexes():
+    return {index['name'] for index in
+            sa.inspect(op.get_bind()).get_indexes('statistics')}
+
+
+def upgrade():
+    missing = [name for name in INDEXES if name not in existing_indexes()]
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        for name in missing:
+            op.create_index(name, 'statistics', INDEXES[name],
+                            postgresql_concurrently=concurrently)
+
+
+def downgrade():
+    present = [name for name in INDEXES if name in existing_indexes()]
+    for name in present:
+        op.drop_index(name, table_name='statistics')
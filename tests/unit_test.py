@@ -1,15 +1,31 @@
 # encoding=utf8
 
+import datetime
+import gzip
 import json
+import os
 import re
 import subprocess
 import sys
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 API_BASEURL = "https://funded-1989.usr.yandex-academy.ru"
 
+# Second API process on the same database, used by test_cross_worker.
+SECOND_API_BASEURL = os.environ.get("SECOND_API_BASEURL")
+
+# Database of the API processes (SQLite or PostgreSQL URL of SQLAlchemy),
+# used by tests changing it behind the API.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
 ROOT_ID = "069cb8d7-bbdd-47d3-ad8f-82ef4c269df1"
 
 IMPORT_BATCHES = [
@@ -165,10 +181,11 @@ EXPECTED_TREE = {
 }
 
 
-def request(path, method="GET", data=None, json_response=False):
+def request(path, method="GET", data=None, json_response=False,
+            base_url=None):
     try:
         params = {
-            "url": f"{API_BASEURL}{path}",
+            "url": f"{base_url or API_BASEURL}{path}",
             "method": method,
             "headers": {},
         }
@@ -191,6 +208,18 @@ def request(path, method="GET", data=None, json_response=False):
         return (e.getcode(), None)
 
 
+def request_raw(path, headers):
+    """ Returns (status, content type, content encoding, body bytes). """
+    req = urllib.request.Request(
+        url=f"{API_BASEURL}{path}", method="GET", headers=headers)
+    try:
+        with urllib.request.urlopen(req) as res:
+            return (res.getcode(), res.headers.get("Content-Type"),
+                    res.headers.get("Content-Encoding"), res.read())
+    except urllib.error.HTTPError as e:
+        return (e.getcode(), None, None, None)
+
+
 def deep_sort_children(node):
     if node.get("children"):
         node["children"].sort(key=lambda x: x["id"])
@@ -251,6 +280,50 @@ def test_sales():
     print("Test sales passed.")
 
 
+def test_sales_price_changes():
+    """
+    /sales returns the latest change of an offer within the 24 hours
+    before date, changes after date are not seen. Run with SALES_BUFFER=1
+    too: then the last two dates are answered from the buffer.
+    """
+    import_batches()
+
+    offer = {"id": "3fa85f64-5717-4562-b3fc-2c963f66a444", "name": "Товар",
+             "parentId": ROOT_ID, "type": "OFFER"}
+    changes = [(100, "2022-02-04T10:00:00.000Z"),
+               (200, "2022-02-04T20:00:00.000Z"),
+               (300, "2022-02-05T06:00:00.000Z")]
+    for price, date in changes:
+        status, _ = request("/imports", method="POST", data={
+            "items": [dict(offer, price=price)], "updateDate": date})
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    for date, expected in [
+        ("2022-02-04T09:00:00.000Z", None),
+        ("2022-02-04T15:00:00.000Z", changes[0]),
+        ("2022-02-05T00:00:00.000Z", changes[1]),
+        ("2022-02-05T12:00:00.000Z", changes[2]),
+        ("2022-02-06T08:00:00.000Z", None),
+    ]:
+        params = urllib.parse.urlencode({"date": date})
+        status, response = request(f"/sales?{params}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        items = [item for item in response["items"]
+                 if item["id"] == offer["id"]]
+        if expected is None:
+            assert items == [], f"Unexpected sales for {date}: {items}"
+        else:
+            assert len(items) == 1 and \
+                   items[0]["price"] == expected[0] and \
+                   items[0]["date"] == expected[1], \
+                   f"Invalid sales for {date}: {items}"
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test sales price changes passed.")
+
+
 def test_stats():
     params = urllib.parse.urlencode({
         "dateStart": "2022-02-01T00:00:00.000Z",
@@ -453,6 +526,153 @@ def test_cascade_update():
     print("Test cascade update date passed.")
 
 
+def wait_second_worker(path, expected_status, expected=None, timeout=10):
+    """ Waits until the second API process returns expected response. """
+    deadline = time.time() + timeout
+    while True:
+        status, response = request(
+            path, json_response=True, base_url=SECOND_API_BASEURL)
+        if status == expected_status and status != 200:
+            return
+        if status == expected_status:
+            deep_sort_children(response)
+            deep_sort_children(expected)
+            if response == expected:
+                return
+        assert time.time() < deadline, \
+            f"Second worker did not apply changes: {status}, {response}"
+        time.sleep(0.2)
+
+
+def test_cross_worker():
+    """
+    Changes made by one API process must be seen by another one with
+    in-process tree index/cache (TREE_SYNC='notify' on local PostgreSQL or
+    TREE_SYNC='poll'). Second process is set by SECOND_API_BASEURL.
+    """
+    if SECOND_API_BASEURL is None:
+        print("Test cross worker skipped: SECOND_API_BASEURL is not set.")
+        return
+
+    for batch in IMPORT_BATCHES:
+        status, _ = request("/imports", method="POST", data=batch)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    wait_second_worker(f"/nodes/{ROOT_ID}", 200, EXPECTED_TREE)
+
+    offer = dict(IMPORT_BATCHES[-1]["items"][0], price=1)
+    status, _ = request("/imports", method="POST", data={
+        "items": [offer], "updateDate": "2022-02-04T12:00:00.000Z"})
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    status, expected = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    wait_second_worker(f"/nodes/{ROOT_ID}", 200, expected)
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    wait_second_worker(f"/nodes/{ROOT_ID}", 404)
+
+    print("Test cross worker passed.")
+
+
+def execute_test_database(statement):
+    """ Executes statement in TEST_DATABASE_URL, returns its rowcount. """
+    if TEST_DATABASE_URL.startswith("sqlite:///"):
+        import sqlite3
+        connection = sqlite3.connect(TEST_DATABASE_URL[len("sqlite:///"):])
+    else:
+        import psycopg2
+        # SQLAlchemy URL "postgresql+psycopg2://..." to libpq URL.
+        connection = psycopg2.connect(re.sub(
+            r"^postgresql\+\w+://", "postgresql://", TEST_DATABASE_URL))
+    try:
+        cursor = connection.cursor()
+        cursor.execute(statement)
+        connection.commit()
+        return cursor.rowcount
+    finally:
+        connection.close()
+
+
+def test_listener_reconnect():
+    """
+    With TREE_SYNC='notify' on PostgreSQL the second API process must
+    reconnect after its LISTEN connection is dropped and see changes made
+    while it was disconnected. Needs SECOND_API_BASEURL and
+    TEST_DATABASE_URL of the database of both processes.
+    """
+    if SECOND_API_BASEURL is None or TEST_DATABASE_URL is None:
+        print("Test listener reconnect skipped: SECOND_API_BASEURL or "
+              "TEST_DATABASE_URL is not set.")
+        return
+
+    import_batches()
+    wait_second_worker(f"/nodes/{ROOT_ID}", 200, EXPECTED_TREE)
+
+    terminated = execute_test_database(
+        "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+        "WHERE query LIKE 'LISTEN %' AND pid <> pg_backend_pid()")
+    assert terminated > 0, "No LISTEN connections to drop"
+
+    offer = dict(IMPORT_BATCHES[-1]["items"][0], price=1)
+    status, _ = request("/imports", method="POST", data={
+        "items": [offer], "updateDate": "2022-02-04T12:00:00.000Z"})
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    status, expected = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    wait_second_worker(f"/nodes/{ROOT_ID}", 200, expected)
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    wait_second_worker(f"/nodes/{ROOT_ID}", 404)
+
+    print("Test listener reconnect passed.")
+
+
+def test_index_check():
+    """
+    With TREE_INDEX=1 POST /nodes-index/check must find nodes changed
+    behind the API and reload them. Needs TEST_DATABASE_URL of the API.
+    """
+    status, _ = request("/nodes-index/check", method="POST")
+    if status == 404 or TEST_DATABASE_URL is None:
+        print("Test index check skipped: TREE_INDEX is off or "
+              "TEST_DATABASE_URL is not set.")
+        return
+
+    import_batches()
+    status, response = request(
+        "/nodes-index/check", method="POST", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert response["ids"] == [], f"Index differs from table: {response}"
+
+    offer_id = "863e1a7a-1304-42ae-943b-179184c077e3"
+    changed = execute_test_database(
+        f"UPDATE products SET name = 'Испорчен' WHERE id = '{offer_id}'")
+    assert changed == 1, f"Expected 1 changed row, got {changed}"
+
+    status, response = request(
+        "/nodes-index/check", method="POST", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert response["ids"] == [offer_id], f"Invalid wrong ids: {response}"
+
+    status, response = request(f"/nodes/{offer_id}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert response["name"] == "Испорчен", f"Node is not reloaded: {response}"
+
+    status, response = request(
+        "/nodes-index/check", method="POST", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert response["ids"] == [], f"Index is not repaired: {response}"
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test index check passed.")
+
+
 def test_json_groups():
     with open('json_groups/test_group.json', mode='r', encoding='utf-8') as file:
         tests = json.load(file)
@@ -493,6 +713,585 @@ def test_json_groups():
     print('Test group passed')
 
 
+def import_batches():
+    for batch in IMPORT_BATCHES:
+        status, _ = request("/imports", method="POST", data=batch)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+
+def test_bulk_delete():
+    import_batches()
+
+    offer_id = "863e1a7a-1304-42ae-943b-179184c077e3"
+    missing_id = "00000000-0000-0000-0000-000000000000"
+    status, response = request("/delete", method="POST", data={
+        "ids": [offer_id, missing_id, "asdfasdf-saf-1"]}, json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    codes = [(item["id"], item["code"]) for item in response["items"]]
+    expected = [(offer_id, 200), (missing_id, 404), ("asdfasdf-saf-1", 400)]
+    assert codes == expected, f"Invalid codes of items: {response}"
+
+    status, _ = request(f"/nodes/{offer_id}", json_response=True)
+    assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    status, _ = request("/delete", method="POST", data={"ids": ROOT_ID})
+    assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    status, response = request(
+        "/delete", method="POST", data={"ids": [ROOT_ID]}, json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert response["items"][0]["code"] == 200, \
+        f"Invalid codes of items: {response}"
+
+    status, _ = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    print("Test bulk delete passed.")
+
+
+def test_nodes_many():
+    import_batches()
+
+    category = next(child for child in EXPECTED_TREE["children"]
+                    if child["id"] == "d515e43f-f3f6-4471-bb77-6b455017a2d2")
+    missing_id = "00000000-0000-0000-0000-000000000000"
+    for query in [f"ids={ROOT_ID},{category['id']},{missing_id}",
+                  f"ids={ROOT_ID}&ids={category['id']}&ids={missing_id}"]:
+        status, response = request(f"/nodes?{query}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+        expected_ids = sorted([ROOT_ID, category["id"], missing_id])
+        assert sorted(response) == expected_ids, \
+            f"Invalid ids of response: {list(response)}"
+        assert response[missing_id] is None, \
+            f"Expected null for missing node, got {response[missing_id]}"
+        check_nodes(EXPECTED_TREE, response[ROOT_ID])
+        check_nodes(category, response[category["id"]])
+
+    for query in ["", "?ids=", f"?ids={ROOT_ID},asdfasdf-saf-1"]:
+        status, _ = request(f"/nodes{query}", json_response=True)
+        assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test nodes many passed.")
+
+
+def test_nodes_pages():
+    import_batches()
+
+    status, response = request(f"/nodes/{ROOT_ID}?depth=0", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert response["children"] == [], \
+        f"Expected no children, got {response['children']}"
+    assert response["childrenCount"] == len(EXPECTED_TREE["children"]), \
+        f"Invalid childrenCount: {response['childrenCount']}"
+    assert response["price"] == EXPECTED_TREE["price"], \
+        f"Invalid price: {response['price']}"
+
+    expected = {child["id"]: child for child in EXPECTED_TREE["children"]}
+    ids = []
+    cursor = None
+    while True:
+        params = {"depth": 1, "limit": 1}
+        if cursor is not None:
+            params["cursor"] = cursor
+        status, response = request(
+            f"/nodes/{ROOT_ID}?{urllib.parse.urlencode(params)}",
+            json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        assert len(response["children"]) == 1, \
+            f"Expected 1 child, got {len(response['children'])}"
+
+        child = response["children"][0]
+        ids.append(child["id"])
+        assert child["children"] == [], \
+            f"Expected no children, got {child['children']}"
+        assert child["childrenCount"] == \
+            len(expected[child["id"]]["children"]), \
+            f"Invalid childrenCount: {child['childrenCount']}"
+
+        cursor = response.get("nextCursor")
+        if cursor is None:
+            break
+        assert len(ids) < len(expected), f"Too many pages: {ids}"
+    assert ids == sorted(expected), f"Invalid children of pages: {ids}"
+
+    for query in ["depth=-1", "limit=0", "limit=a", "cursor=asdfasdf-saf-1"]:
+        status, _ = request(f"/nodes/{ROOT_ID}?{query}", json_response=True)
+        assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    status, _ = request(
+        "/nodes/00000000-0000-0000-0000-000000000000?depth=1",
+        json_response=True)
+    assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test nodes pages passed.")
+
+
+def test_invalid_dates():
+    dates = [
+        "2022-02-04T00:00:00.000",
+        "2022-02-04T00:00:00Z",
+        "2022-02-04 00:00:00.000Z",
+        "2022-02-04T00:00:00.000+00:00",
+        "2022-02-04T00:00:00.000Z1",
+        "2022-02-30T00:00:00.000Z",
+    ]
+    for date in dates:
+        params = urllib.parse.urlencode({"date": date})
+        status, _ = request(f"/sales?{params}", json_response=True)
+        assert status == 400, \
+            f"Expected HTTP status code 400 for {date}, got {status}"
+
+        params = urllib.parse.urlencode({
+            "dateStart": "2022-02-01T00:00:00.000Z", "dateEnd": date})
+        status, _ = request(
+            f"/node/{ROOT_ID}/statistic?{params}", json_response=True)
+        assert status == 400, \
+            f"Expected HTTP status code 400 for {date}, got {status}"
+
+        status, _ = request("/imports", method="POST",
+                            data=dict(IMPORT_BATCHES[0], updateDate=date))
+        assert status == 400, \
+            f"Expected HTTP status code 400 for {date}, got {status}"
+
+    status, _ = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    print("Test invalid dates passed.")
+
+
+def msgpack_dates_to_iso(obj):
+    """ Replaces timestamps of MessagePack response by ISO strings. """
+    if isinstance(obj, dict):
+        return {key: msgpack_dates_to_iso(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [msgpack_dates_to_iso(value) for value in obj]
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    return obj
+
+
+def test_msgpack():
+    if msgpack is None:
+        print("Test msgpack skipped: msgpack is not installed.")
+        return
+
+    import_batches()
+
+    for media_type in ["application/msgpack", "application/x-msgpack"]:
+        status, content_type, _, body = request_raw(
+            f"/nodes/{ROOT_ID}", {"Accept": media_type})
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        if content_type == "application/json":
+            print("Server has no msgpack, MessagePack is not checked.")
+            break
+        assert content_type == "application/msgpack", \
+            f"Expected application/msgpack, got {content_type}"
+        check_nodes(EXPECTED_TREE, msgpack_dates_to_iso(
+            msgpack.unpackb(body, timestamp=3)))
+
+    status, content_type, _, body = request_raw(
+        f"/nodes/{ROOT_ID}", {"Accept": "text/csv"})
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    assert content_type == "application/json", \
+        f"Expected application/json, got {content_type}"
+    check_nodes(EXPECTED_TREE, json.loads(body))
+
+    status, _, encoding, body = request_raw(
+        f"/nodes/{ROOT_ID}", {"Accept-Encoding": "gzip"})
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    if encoding is not None:
+        assert encoding == "gzip", f"Expected gzip, got {encoding}"
+        body = gzip.decompress(body)
+    check_nodes(EXPECTED_TREE, json.loads(body))
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test msgpack passed.")
+
+
+def test_lists_pages():
+    """
+    Pages (limit, cursor) and NDJSON of /sales and /node/<id>/statistic
+    must return the same items as the whole list.
+    """
+    import_batches()
+
+    sales = urllib.parse.urlencode({"date": "2022-02-04T00:00:00.000Z"})
+    for path in [f"/sales?{sales}", f"/node/{ROOT_ID}/statistic?"]:
+        status, response = request(path, json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        items = response["items"]
+        assert len(items) > 1, f"Expected several items, got {items}"
+
+        pages = []
+        cursor = None
+        while True:
+            params = {"limit": 1}
+            if cursor is not None:
+                params["cursor"] = cursor
+            status, response = request(
+                f"{path}&{urllib.parse.urlencode(params)}", json_response=True)
+            assert status == 200, \
+                f"Expected HTTP status code 200, got {status}"
+            pages.extend(response["items"])
+            cursor = response.get("nextCursor")
+            if cursor is None:
+                break
+            assert len(pages) < len(items), f"Too many pages: {pages}"
+        assert pages == items, f"Items of pages don't match list: {pages}"
+
+        status, content_type, _, body = request_raw(
+            path, {"Accept": "application/x-ndjson"})
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        assert content_type == "application/x-ndjson", \
+            f"Expected application/x-ndjson, got {content_type}"
+        lines = [json.loads(line) for line in body.decode().splitlines()]
+        assert lines == items, f"Lines don't match list: {lines}"
+
+        status, _ = request(f"{path}&cursor=1-a", json_response=True)
+        assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test lists pages passed.")
+
+
+def test_pages_before_1970():
+    """ Cursors of pages must work for dates before 1970 too. """
+    offer = {"name": "Товар", "parentId": ROOT_ID, "price": 100,
+             "type": "OFFER"}
+    for items, date in [
+        ([dict(IMPORT_BATCHES[0]["items"][0])], "1969-12-31T10:00:00.000Z"),
+        ([dict(offer, id="3fa85f64-5717-4562-b3fc-2c963f66a111")],
+         "1969-12-31T11:00:00.000Z"),
+        ([dict(offer, id="3fa85f64-5717-4562-b3fc-2c963f66a222")],
+         "1969-12-31T12:00:00.000Z"),
+    ]:
+        status, _ = request("/imports", method="POST", data={
+            "items": items, "updateDate": date})
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    sales = urllib.parse.urlencode({"date": "1970-01-01T00:00:00.000Z"})
+    for path in [f"/sales?{sales}", f"/node/{ROOT_ID}/statistic?"]:
+        status, response = request(path, json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        items = response["items"]
+        assert len(items) > 1, f"Expected several items, got {items}"
+
+        status, response = request(f"{path}&limit=1", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        cursor = response["nextCursor"]
+        assert cursor.startswith("-"), f"Expected negative cursor: {cursor}"
+
+        params = urllib.parse.urlencode({"limit": len(items), "cursor": cursor})
+        status, next_page = request(f"{path}&{params}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        pages = response["items"] + next_page["items"]
+        assert pages == items, f"Items of pages don't match list: {pages}"
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test pages before 1970 passed.")
+
+
+def test_stats_resolution():
+    import_batches()
+
+    offer = IMPORT_BATCHES[1]["items"][1]
+    status, _ = request("/imports", method="POST", data={
+        "items": [dict(offer, price=99999)],
+        "updateDate": "2022-02-02T12:30:00.000Z"})
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    def stats(resolution, date_end="2022-02-03T00:00:00.000Z"):
+        params = urllib.parse.urlencode({
+            "dateStart": "2022-02-02T00:00:00.000Z", "dateEnd": date_end,
+            "resolution": resolution})
+        status, response = request(
+            f"/node/{offer['id']}/statistic?{params}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        return response["items"]
+
+    items = stats("raw")
+    assert [item["price"] for item in items] == [79999, 99999], \
+        f"Invalid raw statistics: {items}"
+
+    for resolution, date in [("hour", "2022-02-02T12:00:00.000Z"),
+                             ("day", "2022-02-02T00:00:00.000Z")]:
+        items = stats(resolution)
+        assert len(items) == 1, f"Expected 1 item, got {items}"
+        item = items[0]
+        assert item["date"] == date, f"Invalid date of bucket: {item}"
+        prices = (item["price"], item["firstPrice"], item["lastPrice"],
+                  item["minPrice"], item["maxPrice"])
+        assert prices == (89999, 79999, 99999, 79999, 99999), \
+            f"Invalid prices of bucket: {item}"
+
+    assert stats("auto") == stats("raw"), "Expected raw statistics of a day"
+    week = "2022-02-09T00:00:00.000Z"
+    assert stats("auto", week) == stats("hour", week), \
+        "Expected hourly statistics of a week"
+
+    params = urllib.parse.urlencode({"resolution": "week"})
+    status, _ = request(
+        f"/node/{offer['id']}/statistic?{params}", json_response=True)
+    assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test stats resolution passed.")
+
+
+def test_offer_parent():
+    import_batches()
+
+    status, expected = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    offer_id = "863e1a7a-1304-42ae-943b-179184c077e3"
+    child_id = "3fa85f64-5717-4562-b3fc-2c963f66a444"
+    for item_type, price in [("OFFER", 100), ("CATEGORY", None)]:
+        status, _ = request("/imports", method="POST", data={
+            "items": [{"id": child_id, "name": "Товар в товаре",
+                       "parentId": offer_id, "price": price,
+                       "type": item_type}],
+            "updateDate": "2022-02-04T12:00:00.000Z"})
+        assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    status, _ = request(f"/nodes/{child_id}", json_response=True)
+    assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    status, response = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    check_nodes(expected, response)
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test offer parent passed.")
+
+
+def test_parent_not_found():
+    import_batches()
+
+    status, expected = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    category_id = "3fa85f64-5717-4562-b3fc-2c963f66a555"
+    offer_id = "3fa85f64-5717-4562-b3fc-2c963f66a666"
+    status, _ = request("/imports", method="POST", data={
+        "items": [
+            {"id": category_id, "name": "Кат. без родителя",
+             "parentId": "3fa85f64-5717-4562-b3fc-2c963f66a777",
+             "price": None, "type": "CATEGORY"},
+            {"id": offer_id, "name": "Товар", "parentId": category_id,
+             "price": 100, "type": "OFFER"},
+            {"id": "863e1a7a-1304-42ae-943b-179184c077e3", "name": "jPhone 13",
+             "parentId": "d515e43f-f3f6-4471-bb77-6b455017a2d2",
+             "price": 1, "type": "OFFER"}],
+        "updateDate": "2022-02-04T12:00:00.000Z"})
+    assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    for node_id in [category_id, offer_id]:
+        status, _ = request(f"/nodes/{node_id}", json_response=True)
+        assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    status, response = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    check_nodes(expected, response)
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test parent not found passed.")
+
+
+def check_rejected_import(items):
+    """
+    Imports items after IMPORT_BATCHES, checks that the import is rejected
+    with 400 and the tree is not changed.
+    """
+    import_batches()
+
+    status, expected = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    status, _ = request("/imports", method="POST", data={
+        "items": items, "updateDate": "2022-02-04T12:00:00.000Z"})
+    assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    status, response = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+    check_nodes(expected, response)
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+
+def test_duplicate_ids():
+    offer_id = "3fa85f64-5717-4562-b3fc-2c963f66a666"
+    for items in [
+        [{"id": offer_id, "name": "Товар", "parentId": ROOT_ID,
+          "price": 100, "type": "OFFER"},
+         {"id": offer_id, "name": "Товар 2", "parentId": ROOT_ID,
+          "price": 200, "type": "OFFER"}],
+        [{"id": "863e1a7a-1304-42ae-943b-179184c077e3", "name": "jPhone 13",
+          "parentId": ROOT_ID, "price": 1, "type": "OFFER"},
+         {"id": "863e1a7a-1304-42ae-943b-179184c077e3", "name": "jPhone 13",
+          "parentId": "d515e43f-f3f6-4471-bb77-6b455017a2d2",
+          "price": 2, "type": "OFFER"}],
+    ]:
+        check_rejected_import(items)
+        status, _ = request(f"/nodes/{offer_id}", json_response=True)
+        assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    print("Test duplicate ids passed.")
+
+
+def test_import_cycle():
+    first_id = "3fa85f64-5717-4562-b3fc-2c963f66a555"
+    second_id = "3fa85f64-5717-4562-b3fc-2c963f66a666"
+    phones_id = "d515e43f-f3f6-4471-bb77-6b455017a2d2"
+    for items in [
+        # Cycle of new categories.
+        [{"id": first_id, "name": "Первая", "parentId": second_id,
+          "price": None, "type": "CATEGORY"},
+         {"id": second_id, "name": "Вторая", "parentId": first_id,
+          "price": None, "type": "CATEGORY"}],
+        # Existing category is moved under its new child.
+        [{"id": first_id, "name": "Первая", "parentId": phones_id,
+          "price": None, "type": "CATEGORY"},
+         {"id": phones_id, "name": "Смартфоны", "parentId": first_id,
+          "price": None, "type": "CATEGORY"}],
+    ]:
+        check_rejected_import(items)
+        for node_id in [first_id, second_id]:
+            status, _ = request(f"/nodes/{node_id}", json_response=True)
+            assert status == 404, \
+                f"Expected HTTP status code 404, got {status}"
+
+    print("Test import cycle passed.")
+
+
+def iso_now(delta=datetime.timedelta()):
+    """ Returns current time plus delta in format of updateDate. """
+    date = datetime.datetime.utcnow() + delta
+    return date.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def wait_import_job(job_id, timeout=10):
+    """ Waits until asynchronous import job_id is applied, returns status. """
+    deadline = time.time() + timeout
+    while True:
+        status, response = request(f"/imports/{job_id}", json_response=True)
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        if response["status"] == "DONE":
+            return response
+        assert response["status"] in ("QUEUED", "RUNNING"), \
+            f"Import failed: {response}"
+        assert time.time() < deadline, f"Import is not applied: {response}"
+        time.sleep(0.2)
+
+
+def test_async_imports():
+    """
+    With IMPORTS_ASYNC=1 POST /imports returns 202 with jobId and the
+    import is applied in background, GET /imports/<jobId> returns status
+    of the job. Imports older than the last applied one are rejected, so
+    the test imports with the current time.
+    """
+    batch = dict(IMPORT_BATCHES[0], updateDate=iso_now())
+    status, response = request(
+        "/imports", method="POST", data=batch, json_response=True)
+    if status == 200:
+        status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        print("Test async imports skipped: imports are synchronous.")
+        return
+
+    assert status == 202, f"Expected HTTP status code 202, got {status}"
+    response = wait_import_job(response["jobId"])
+    assert response["items"] == 1 and response["processed"] == 1, \
+        f"Invalid job status: {response}"
+    assert response["updateDate"] == batch["updateDate"], \
+        f"Invalid job status: {response}"
+
+    status, _ = request(f"/nodes/{ROOT_ID}", json_response=True)
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    status, _ = request(
+        "/imports/00000000-0000-0000-0000-000000000000", json_response=True)
+    assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test async imports passed.")
+
+
+def test_async_imports_order():
+    """
+    With IMPORTS_ASYNC=1 an import older than the last applied one is
+    rejected, and deletes are applied after imports accepted before them.
+    """
+    batch = dict(IMPORT_BATCHES[0], updateDate=iso_now())
+    status, response = request(
+        "/imports", method="POST", data=batch, json_response=True)
+    if status == 200:
+        status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+        print("Test async imports order skipped: imports are synchronous.")
+        return
+
+    assert status == 202, f"Expected HTTP status code 202, got {status}"
+    wait_import_job(response["jobId"])
+
+    older = dict(IMPORT_BATCHES[0],
+                 updateDate=iso_now(-datetime.timedelta(days=1)))
+    status, _ = request("/imports", method="POST", data=older)
+    assert status == 400, f"Expected HTTP status code 400, got {status}"
+
+    offer = {"id": "3fa85f64-5717-4562-b3fc-2c963f66a888", "name": "Товар",
+             "parentId": ROOT_ID, "price": 100, "type": "OFFER"}
+    for bulk in [False, True]:
+        status, response = request("/imports", method="POST", data={
+            "items": [offer], "updateDate": iso_now()}, json_response=True)
+        assert status == 202, f"Expected HTTP status code 202, got {status}"
+        job_id = response["jobId"]
+
+        # Delete is sent at once, before the import is applied.
+        if bulk:
+            status, response = request("/delete", method="POST", data={
+                "ids": [offer["id"]]}, json_response=True)
+            assert status == 200, \
+                f"Expected HTTP status code 200, got {status}"
+            status = response["items"][0]["code"]
+        else:
+            status, _ = request(f"/delete/{offer['id']}", method="DELETE")
+        assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+        wait_import_job(job_id)
+        status, _ = request(f"/nodes/{offer['id']}", json_response=True)
+        assert status == 404, f"Expected HTTP status code 404, got {status}"
+
+    status, _ = request(f"/delete/{ROOT_ID}", method="DELETE")
+    assert status == 200, f"Expected HTTP status code 200, got {status}"
+
+    print("Test async imports order passed.")
+
+
 def test_all():
     """ Call all 'test_' functions. """
 
@@ -508,6 +1307,24 @@ def test_all():
     test_invalid_uuid()
     test_cascade_update()
     test_json_groups()
+    test_bulk_delete()
+    test_nodes_many()
+    test_nodes_pages()
+    test_invalid_dates()
+    test_msgpack()
+    test_lists_pages()
+    test_pages_before_1970()
+    test_stats_resolution()
+    test_offer_parent()
+    test_parent_not_found()
+    test_sales_price_changes()
+    test_duplicate_ids()
+    test_import_cycle()
+    test_async_imports()
+    test_async_imports_order()
+    test_cross_worker()
+    test_index_check()
+    test_listener_reconnect()
 
 
 def main():